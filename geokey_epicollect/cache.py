@@ -0,0 +1,261 @@
+"""
+Caches serialised EcML forms using Django's cache framework, and keeps the
+version tokens that identify the current state of a project. Forms are
+cached per project and host, and keyed by a schema version that is replaced
+whenever the project, one of its categories, fields or lookup values
+changes. The data version is replaced whenever one of the project's
+observations changes. Stale forms are never invalidated one by one; they are
+simply not looked up again and expire from the cache.
+
+Versions must be shared by all processes to take effect everywhere at once.
+The cache named by `EPICOLLECT_CACHE` is used. If it is local to the process
+(`LocMemCache`) or does not store anything (`DummyCache`), versions and forms
+expire after `EPICOLLECT_LOCAL_CACHE_TIMEOUT` seconds, so that a change made
+in another process is picked up within that time.
+
+Process-local caches for values that are read on every request are provided
+by `LRUCache` and `TTLCache`.
+"""
+import time
+import threading
+from uuid import uuid4
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+
+
+CACHE_ALIAS = getattr(settings, 'EPICOLLECT_CACHE', 'default')
+FORM_CACHE_TIMEOUT = getattr(settings, 'EPICOLLECT_FORM_CACHE_TIMEOUT', 86400)
+LOCAL_CACHE_TIMEOUT = getattr(settings, 'EPICOLLECT_LOCAL_CACHE_TIMEOUT', 60)
+
+
+def get_cache():
+    return caches[CACHE_ALIAS]
+
+
+def is_shared_cache():
+    """
+    Returns whether the cache is shared by all processes.
+    """
+    return not isinstance(get_cache(), (LocMemCache, DummyCache))
+
+
+def get_version_timeout():
+    """
+    Returns the time versions are kept: forever in a shared cache, otherwise
+    `EPICOLLECT_LOCAL_CACHE_TIMEOUT` seconds.
+    """
+    return None if is_shared_cache() else LOCAL_CACHE_TIMEOUT
+
+
+def get_version_key(name, project_id):
+    return 'geokey_epicollect:%s_version:%s' % (name, project_id)
+
+
+def get_form_key(project_id, host, version):
+    return 'geokey_epicollect:form:%s:%s:%s' % (project_id, host, version)
+
+
+def create_version():
+    """
+    Returns a new version token, prefixed with the time it was created.
+    """
+    return '%d.%s' % (time.time(), uuid4().hex)
+
+
+def get_version_timestamp(version):
+    """
+    Returns the time, in seconds since the epoch, the version was created.
+    """
+    return int(version.split('.', 1)[0])
+
+
+def get_version(name, project_id):
+    """
+    Returns the current version of the project. A new version is created if
+    none is stored, e.g. because the cache has been cleared.
+    """
+    cache = get_cache()
+    key = get_version_key(name, project_id)
+    version = cache.get(key)
+
+    if version is None:
+        cache.add(key, create_version(), get_version_timeout())
+        version = cache.get(key) or create_version()
+
+    return version
+
+
+def bump_version(name, project_id):
+    """
+    Replaces the version of the project, so that anything derived from the
+    previous version is not used anymore.
+    """
+    get_cache().set(
+        get_version_key(name, project_id),
+        create_version(),
+        get_version_timeout()
+    )
+
+
+def get_schema_version(project_id):
+    return get_version('schema', project_id)
+
+
+def bump_schema_version(project_id):
+    bump_version('schema', project_id)
+
+
+def get_data_version(project_id):
+    return get_version('data', project_id)
+
+
+def bump_data_version(project_id):
+    bump_version('data', project_id)
+
+
+def get_cached_form(project_id, host, version):
+    """
+    Returns the serialised form for the project and host, or `None` if it
+    has not been cached for the schema version.
+    """
+    return get_cache().get(get_form_key(project_id, host, version))
+
+
+def set_cached_form(project_id, host, version, form):
+    """
+    Caches the serialised form for the project and host. The version must be
+    the one read before the form was serialised, so that a form built while
+    the schema changed is never stored under the new version.
+    """
+    timeout = FORM_CACHE_TIMEOUT
+    if not is_shared_cache():
+        timeout = min(timeout, LOCAL_CACHE_TIMEOUT)
+
+    get_cache().set(get_form_key(project_id, host, version), form, timeout)
+
+
+class LRUCache(object):
+    """
+    Process-local cache that keeps the `size` most recently used items. If
+    `timeout` is given, items also expire that many seconds after they were
+    stored.
+    """
+    def __init__(self, size, timeout=None):
+        self.size = size
+        self.timeout = timeout
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Returns the item stored for the key, or `None`.
+        """
+        with self.lock:
+            try:
+                value, expires = self.items.pop(key)
+            except KeyError:
+                return None
+
+            if expires is not None and expires <= time.time():
+                return None
+
+            self.items[key] = (value, expires)
+            return value
+
+    def set(self, key, value):
+        expires = None
+        if self.timeout is not None:
+            expires = time.time() + self.timeout
+
+        with self.lock:
+            self.items.pop(key, None)
+            self.items[key] = (value, expires)
+
+            while len(self.items) > self.size:
+                self.items.popitem(last=False)
+
+    def discard(self, predicate):
+        """
+        Removes all items for which `predicate(value)` is true.
+        """
+        with self.lock:
+            for key, (value, expires) in list(self.items.items()):
+                if predicate(value):
+                    del self.items[key]
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+
+
+class TTLCache(object):
+    """
+    Process-local cache whose items expire `timeout` seconds after they were
+    stored. At most `size` items are kept, the least recently used are
+    removed first, so that lookups of arbitrary keys cannot grow the cache
+    without limit. Hits and misses are counted, so that the hit rate can be
+    reported.
+    """
+    def __init__(self, timeout, size=1024):
+        self.timeout = timeout
+        self.size = size
+        self.items = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get_or_set(self, key, load):
+        """
+        Returns the item stored for the key. If there is none or it has
+        expired, `load()` is called and its result is stored, even if it is
+        `None`.
+        """
+        now = time.time()
+
+        with self.lock:
+            item = self.items.pop(key, None)
+            if item is not None and item[1] > now:
+                self.items[key] = item
+                self.hits += 1
+                return item[0]
+
+            self.misses += 1
+
+        value = load()
+
+        with self.lock:
+            self.items.pop(key, None)
+            self.items[key] = (value, now + self.timeout)
+
+            while len(self.items) > self.size:
+                self.items.popitem(last=False)
+
+        return value
+
+    def discard(self, key):
+        with self.lock:
+            self.items.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return float(self.hits) / lookups if lookups else 0.0
+
+    def stats(self):
+        """
+        Returns the number of hits, misses and items, and the hit rate.
+        """
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'items': len(self.items),
+            'hit_rate': self.hit_rate
+        }
@@ -0,0 +1,46 @@
+"""
+Cursors for delta downloads. A cursor is an opaque, signed token that marks
+the time a download was started; passing it as `since` to the next download
+returns only the entries that changed after that time.
+"""
+import calendar
+from datetime import datetime, timedelta
+
+from pytz import utc
+
+from django.core import signing
+
+
+CURSOR_SALT = 'geokey_epicollect.cursors'
+EPOCH = datetime(1970, 1, 1, tzinfo=utc)
+
+
+def create_cursor(timestamp):
+    """
+    Returns the cursor for a timezone-aware datetime.
+    """
+    return signing.dumps(
+        calendar.timegm(timestamp.utctimetuple()) * 1000000 +
+        timestamp.microsecond,
+        salt=CURSOR_SALT
+    )
+
+
+def parse_since(value):
+    """
+    Returns the timezone-aware datetime for the value of a `since`
+    parameter, which is either a cursor or the number of seconds since the
+    epoch. Raises `ValueError` if the value is neither.
+    """
+    try:
+        microseconds = signing.loads(value, salt=CURSOR_SALT)
+    except signing.BadSignature:
+        try:
+            microseconds = float(value) * 1000000
+        except (TypeError, ValueError):
+            raise ValueError('Invalid value for since: %s' % value)
+
+    try:
+        return EPOCH + timedelta(microseconds=microseconds)
+    except (OverflowError, ValueError):
+        raise ValueError('Invalid value for since: %s' % value)
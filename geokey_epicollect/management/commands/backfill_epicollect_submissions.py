@@ -0,0 +1,67 @@
+"""Command `backfill_epicollect_submissions`."""
+
+from django.core.management.base import BaseCommand
+
+from geokey.contributions.models import Observation
+
+from ...models import EpiCollectProject, EpiCollectSubmission
+
+
+class Command(BaseCommand):
+    """
+    A command to record the unique IDs of entries that were uploaded before
+    repeated uploads were detected. The oldest contribution of each unique ID
+    is recorded; unique IDs that are recorded already are skipped.
+    """
+    help = 'Records the unique IDs of entries uploaded from EpiCollect.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of submissions inserted per query.'
+        )
+
+    def backfill_project(self, project_id, batch_size):
+        recorded = set(EpiCollectSubmission.objects.filter(
+            project_id=project_id).values_list('unique_id', flat=True))
+
+        observations = Observation.objects.prefetch_related(None).filter(
+            project_id=project_id).order_by('id').values_list(
+            'id', 'properties')
+
+        count = 0
+        submissions = []
+
+        for observation_id, properties in observations.iterator():
+            unique_id = (properties or {}).get('unique_id')
+
+            if (not isinstance(unique_id, basestring) or not unique_id or
+                    len(unique_id) > 255 or unique_id in recorded):
+                continue
+
+            recorded.add(unique_id)
+            submissions.append(EpiCollectSubmission(
+                project_id=project_id,
+                unique_id=unique_id,
+                contribution_id=observation_id
+            ))
+
+            if len(submissions) >= batch_size:
+                EpiCollectSubmission.objects.bulk_create(submissions)
+                count += len(submissions)
+                submissions = []
+
+        EpiCollectSubmission.objects.bulk_create(submissions)
+        return count + len(submissions)
+
+    def handle(self, *args, **options):
+        count = 0
+
+        project_ids = EpiCollectProject.objects.values_list(
+            'project_id', flat=True)
+        for project_id in project_ids:
+            count += self.backfill_project(project_id, options['batch_size'])
+
+        self.stdout.write('Recorded %s submissions.' % count)
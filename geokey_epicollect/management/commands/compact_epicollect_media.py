@@ -0,0 +1,50 @@
+"""Command `compact_epicollect_media`."""
+
+import time
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from ...models import EpiCollectMedia
+
+
+class Command(BaseCommand):
+    """
+    A command to delete pending media files whose photo or video has not
+    been uploaded within `EPICOLLECT_MEDIA_TTL` days. Rows are deleted in
+    batches, so that no long-running transaction holds locks on the table.
+    """
+    help = 'Deletes pending EpiCollect media files that never arrived.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--ttl',
+            type=float,
+            default=getattr(settings, 'EPICOLLECT_MEDIA_TTL', 30),
+            help='Days after which pending media files expire.'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of rows deleted per query.'
+        )
+
+    def handle(self, *args, **options):
+        started = time.time()
+        before = timezone.now() - timedelta(days=options['ttl'])
+
+        count = 0
+        while True:
+            deleted = EpiCollectMedia.objects.delete_expired(
+                before, options['batch_size'])
+            count += deleted
+
+            if deleted < options['batch_size']:
+                break
+
+        self.stdout.write('Reclaimed %s pending media files in %.2fs.' % (
+            count, time.time() - started))
@@ -0,0 +1,46 @@
+"""Command `process_epicollect_uploads`."""
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from ...staging import process_staged_entries
+
+
+class Command(BaseCommand):
+    """
+    A command to process entries staged by asynchronous uploads. Processes
+    all entries that are due and exits, or keeps polling for new entries if
+    `--wait` is given.
+    """
+    help = 'Processes entries uploaded from EpiCollect asynchronously.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=100,
+            help='Number of entries processed per transaction.'
+        )
+        parser.add_argument(
+            '--wait',
+            type=float,
+            default=None,
+            help='Seconds to wait for new entries instead of exiting.'
+        )
+
+    def handle(self, *args, **options):
+        count = 0
+
+        while True:
+            processed = process_staged_entries(options['batch_size'])
+            count += processed
+
+            if processed:
+                continue
+            elif options.get('wait') is None:
+                break
+
+            time.sleep(options['wait'])
+
+        self.stdout.write('Processed %s entries.' % count)
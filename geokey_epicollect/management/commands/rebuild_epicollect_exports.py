@@ -0,0 +1,52 @@
+"""Command `rebuild_epicollect_exports`."""
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from ...models import EpiCollectProject, EpiCollectExportRow
+
+
+class Command(BaseCommand):
+    """
+    A command to serialise the observations of projects enabled for
+    EpiCollect into their export snapshots. Snapshots are kept up to date
+    when observations are saved; this builds them for projects enabled
+    before, and repairs them after changes made without signals, e.g.
+    queryset updates.
+    """
+    help = 'Rebuilds the export snapshots of EpiCollect projects.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--project',
+            type=int,
+            action='append',
+            dest='project_ids',
+            help='ID of a project to rebuild; all enabled projects if none.'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of observations serialised per query.'
+        )
+
+    def handle(self, *args, **options):
+        started = time.time()
+
+        project_ids = EpiCollectProject.objects.filter(
+            enabled=True).values_list('project_id', flat=True)
+        if options['project_ids']:
+            project_ids = project_ids.filter(
+                project_id__in=options['project_ids'])
+
+        count = 0
+        projects = 0
+        for project_id in project_ids:
+            count += EpiCollectExportRow.objects.rebuild(
+                project_id, options['batch_size'])
+            projects += 1
+
+        self.stdout.write('Rebuilt %s rows of %s projects in %.2fs.' % (
+            count, projects, time.time() - started))
@@ -0,0 +1,174 @@
+"""
+Timers and counters for the form, upload and download endpoints, exposed in
+the Prometheus text format. Metrics are collected per process and only if
+`EPICOLLECT_METRICS_ENABLED` is set; otherwise `timer` returns a shared no-op
+and `increment` returns at once, so instrumented code pays next to nothing.
+"""
+import time
+import threading
+
+from collections import defaultdict
+
+from django.conf import settings
+
+
+ENABLED = getattr(settings, 'EPICOLLECT_METRICS_ENABLED', False)
+
+
+def escape_label_value(value):
+    """
+    Escapes the backslashes, double quotes and line feeds of a label value,
+    as the Prometheus text format requires.
+    """
+    return unicode(value).replace('\\', '\\\\').replace(
+        '"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+
+    return '{%s}' % ','.join(
+        '%s="%s"' % (name, escape_label_value(value))
+        for name, value in labels
+    )
+
+
+class Registry(object):
+    """
+    Holds the counters and the timers, as count and sum of the seconds
+    measured, keyed by name and labels.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = defaultdict(int)
+        self.timers = defaultdict(lambda: [0, 0.0])
+
+    def increment(self, name, value, labels):
+        with self.lock:
+            self.counters[(name, labels)] += value
+
+    def observe(self, name, seconds, labels):
+        with self.lock:
+            timer = self.timers[(name, labels)]
+            timer[0] += 1
+            timer[1] += seconds
+
+    def clear(self):
+        with self.lock:
+            self.counters.clear()
+            self.timers.clear()
+
+    def render(self, gauges=None):
+        """
+        Returns the metrics in the Prometheus text format. `gauges` are
+        `(name, labels, value)` tuples added as they are, e.g. cache
+        statistics.
+        """
+        with self.lock:
+            counters = sorted(self.counters.items())
+            timers = sorted(
+                (key, list(value)) for key, value in self.timers.items())
+
+        lines = []
+        names = set()
+
+        for (name, labels), value in counters:
+            if name not in names:
+                names.add(name)
+                lines.append('# TYPE %s counter' % name)
+            lines.append('%s%s %s' % (name, format_labels(labels), value))
+
+        for (name, labels), (count, total) in timers:
+            if name not in names:
+                names.add(name)
+                lines.append('# TYPE %s summary' % name)
+            lines.append('%s_count%s %s' % (
+                name, format_labels(labels), count))
+            lines.append('%s_sum%s %r' % (
+                name, format_labels(labels), total))
+
+        for name, labels, value in gauges or []:
+            if name not in names:
+                names.add(name)
+                lines.append('# TYPE %s gauge' % name)
+            lines.append('%s%s %s' % (
+                name, format_labels(sorted(labels.items())), value))
+
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+class Timer(object):
+    """
+    Context manager that adds the seconds spent in its block to a timer.
+    """
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.time()
+        return self
+
+    def __exit__(self, *args):
+        registry.observe(self.name, time.time() - self.started, self.labels)
+
+
+class NullTimer(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+NULL_TIMER = NullTimer()
+
+
+def timer(view, stage):
+    """
+    Returns a context manager that times a stage of a view.
+    """
+    if not ENABLED:
+        return NULL_TIMER
+
+    return Timer(
+        'epicollect_stage_seconds', (('stage', stage), ('view', view)))
+
+
+def increment(name, value=1, **labels):
+    """
+    Adds the value to a counter.
+    """
+    if ENABLED:
+        registry.increment(name, value, tuple(sorted(labels.items())))
+
+
+def count_bytes(chunks, view, **labels):
+    """
+    Passes the chunks of a streaming response through, counting the bytes
+    emitted. The chunks are returned as they are if metrics are disabled.
+    """
+    if not ENABLED:
+        return chunks
+
+    def counted():
+        size = 0
+        started = time.time()
+
+        for chunk in chunks:
+            size += len(chunk)
+            yield chunk
+
+        labels['view'] = view
+        increment('epicollect_bytes_emitted_total', size, **labels)
+        registry.observe(
+            'epicollect_stage_seconds',
+            time.time() - started,
+            (('stage', 'stream'), ('view', view))
+        )
+
+    return counted()
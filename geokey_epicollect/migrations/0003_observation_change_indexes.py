@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contributions', '0005_auto_20150202_1135'),
+        ('geokey_epicollect', '0002_epicollectmedia'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            'CREATE INDEX geokey_epicollect_observation_updated_at '
+            'ON contributions_observation (project_id, updated_at);',
+            'DROP INDEX IF EXISTS geokey_epicollect_observation_updated_at;'
+        ),
+    ]
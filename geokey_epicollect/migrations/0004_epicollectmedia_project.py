@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+def set_project(apps, schema_editor):
+    EpiCollectMedia = apps.get_model('geokey_epicollect', 'EpiCollectMedia')
+
+    project_ids = EpiCollectMedia.objects.values_list(
+        'contribution__project_id', flat=True).distinct()
+
+    for project_id in project_ids:
+        EpiCollectMedia.objects.filter(
+            contribution__project_id=project_id).update(project_id=project_id)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0005_auto_20150202_1041'),
+        ('geokey_epicollect', '0003_observation_change_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='epicollectmedia',
+            name='project',
+            field=models.ForeignKey(to='projects.Project', null=True),
+        ),
+        migrations.RunPython(set_project, migrations.RunPython.noop),
+    ]
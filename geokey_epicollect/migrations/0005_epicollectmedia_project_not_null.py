@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+    """
+    Separate from `0004_epicollectmedia_project`, so that the foreign key is
+    altered in a new transaction. PostgreSQL does not alter a table with
+    pending trigger events, which the data migration leaves behind.
+    """
+
+    dependencies = [
+        ('geokey_epicollect', '0004_epicollectmedia_project'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='epicollectmedia',
+            name='project',
+            field=models.ForeignKey(to='projects.Project'),
+        ),
+        migrations.AlterIndexTogether(
+            name='epicollectmedia',
+            index_together=set([('project', 'file_name')]),
+        ),
+    ]
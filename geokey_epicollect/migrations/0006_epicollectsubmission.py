@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0005_auto_20150202_1041'),
+        ('contributions', '0005_auto_20150202_1135'),
+        ('geokey_epicollect', '0005_epicollectmedia_project_not_null'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EpiCollectSubmission',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('unique_id', models.CharField(max_length=255)),
+                ('contribution', models.ForeignKey(to='contributions.Observation')),
+                ('project', models.ForeignKey(to='projects.Project')),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+        migrations.AlterUniqueTogether(
+            name='epicollectsubmission',
+            unique_together=set([('project', 'unique_id')]),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0005_auto_20150202_1041'),
+        ('geokey_epicollect', '0006_epicollectsubmission'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EpiCollectStagedEntry',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('payload', models.TextField()),
+                ('device_id', models.CharField(max_length=255, null=True, blank=True)),
+                ('status', models.CharField(default='pending', max_length=20, choices=[('pending', 'pending'), ('failed', 'failed')])),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('last_error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('project', models.ForeignKey(to='projects.Project')),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+        migrations.AlterIndexTogether(
+            name='epicollectstagedentry',
+            index_together=set([('status', 'next_attempt_at')]),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contributions', '0005_auto_20150202_1135'),
+        ('geokey_epicollect', '0007_epicollectstagedentry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EpiCollectMediaHash',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('digest', models.CharField(max_length=64)),
+                ('kind', models.CharField(max_length=10, choices=[('image', 'image'), ('video', 'video')])),
+                ('media_file', models.ForeignKey(to='contributions.MediaFile')),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+        migrations.AlterUniqueTogether(
+            name='epicollectmediahash',
+            unique_together=set([('digest', 'kind')]),
+        ),
+    ]
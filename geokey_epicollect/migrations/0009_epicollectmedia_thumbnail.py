@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contributions', '0005_auto_20150202_1135'),
+        ('geokey_epicollect', '0008_epicollectmediahash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='epicollectmedia',
+            name='preview',
+            field=models.FileField(null=True, upload_to='user-uploads/epicollect/previews', blank=True),
+        ),
+        migrations.AddField(
+            model_name='epicollectmedia',
+            name='thumbnail',
+            field=models.ForeignKey(related_name='+', on_delete=django.db.models.deletion.SET_NULL, blank=True, to='contributions.ImageFile', null=True),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('geokey_epicollect', '0009_epicollectmedia_thumbnail'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='epicollectmedia',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, auto_now_add=True, db_index=True),
+            preserve_default=False,
+        ),
+    ]
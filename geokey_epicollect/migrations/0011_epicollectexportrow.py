@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0005_auto_20150202_1041'),
+        ('contributions', '0005_auto_20150202_1135'),
+        ('geokey_epicollect', '0010_epicollectmedia_created_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EpiCollectExportRow',
+            fields=[
+                ('observation', models.OneToOneField(related_name='+', primary_key=True, serialize=False, to='contributions.Observation')),
+                ('updated_at', models.DateTimeField(null=True)),
+                ('xml', models.TextField()),
+                ('tsv', models.TextField()),
+                ('project', models.ForeignKey(related_name='+', to='projects.Project')),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+        migrations.AlterIndexTogether(
+            name='epicollectexportrow',
+            index_together=set([('project', 'updated_at')]),
+        ),
+    ]
@@ -1,4 +1,26 @@
-from django.db import models
+from django.conf import settings
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import models, transaction, IntegrityError
+from django.db.models import (
+    Case, Count, F, IntegerField, Q, Sum, Value, When
+)
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from geokey.projects.models import Project
+from geokey.categories.models import (
+    Category, Field, LookupValue, MultipleLookupValue
+)
+from geokey.contributions.models import Location, Observation
+from geokey.users.models import User
+
+from .cache import (
+    TTLCache, get_cache, get_version_key, get_schema_version,
+    bump_schema_version, bump_data_version
+)
+from .upload import invalidate_category_schemas
+from .serializer import DataSerializer
 
 
 class EpiCollectProject(models.Model):
@@ -11,7 +33,575 @@ class EpiCollectProject(models.Model):
 
     objects = models.Manager()
 
+    def delete(self, *args, **kwargs):
+        """
+        Deletes the settings together with the project's export rows. The
+        index page deletes settings in bulk and their rows with them.
+        """
+        with transaction.atomic():
+            EpiCollectExportRow.objects.filter(
+                project_id=self.project_id).delete()
+            return super(EpiCollectProject, self).delete(*args, **kwargs)
+
+
+class EpiCollectMediaManager(models.Manager):
+    def get_pending(self, project_id, file_name):
+        """
+        Returns the pending media file of the project with the given name, or
+        `None` if there is none. Uses the (project, file_name) index.
+        """
+        return self.get_queryset().select_related('contribution').filter(
+            project_id=project_id,
+            file_name=file_name
+        ).order_by('id').first()
+
+    def for_entry(self, project, contribution, data):
+        """
+        Returns new, unsaved instances for the photo and video an uploaded
+        entry refers to. The files are uploaded separately.
+        """
+        return [
+            self.model(
+                project=project,
+                contribution=contribution,
+                file_name=data.get(key)
+            )
+            for key in ['photo', 'video'] if data.get(key) is not None
+        ]
+
+    def delete_expired(self, before, batch_size):
+        """
+        Deletes up to `batch_size` pending media files created before the
+        given time, whose files never arrived, and returns how many were
+        deleted. Their previews are removed from the storage; thumbnails
+        stored as images are kept, as they are the only copy of the photo.
+        """
+        expired = list(self.get_queryset().filter(
+            created_at__lt=before
+        ).order_by('created_at').only('id', 'preview')[:batch_size])
+
+        for epicollect_file in expired:
+            if epicollect_file.preview:
+                epicollect_file.preview.delete(save=False)
+
+        self.get_queryset().filter(
+            id__in=[epicollect_file.id for epicollect_file in expired]
+        ).delete()
+
+        return len(expired)
+
 
 class EpiCollectMedia(models.Model):
     file_name = models.CharField(max_length=500)
     contribution = models.ForeignKey('contributions.observation')
+    project = models.ForeignKey('projects.Project')
+    preview = models.FileField(
+        upload_to='user-uploads/epicollect/previews',
+        null=True,
+        blank=True
+    )
+    thumbnail = models.ForeignKey(
+        'contributions.ImageFile',
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+        related_name='+'
+    )
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    objects = EpiCollectMediaManager()
+
+    class Meta:
+        index_together = [['project', 'file_name']]
+
+    def remove_thumbnail(self):
+        """
+        Removes the preview or the thumbnail that was kept until the full
+        image arrived, depending on `EPICOLLECT_THUMBNAIL_POLICY`.
+        """
+        if self.preview:
+            self.preview.delete(save=False)
+
+        if self.thumbnail is not None:
+            self.thumbnail.delete()
+
+
+class EpiCollectMediaHashManager(models.Manager):
+    def get_stored(self, digest, kind):
+        """
+        Returns the hash of a stored file of the kind with the given digest,
+        or `None` if there is none. Hashes of files that are no longer in
+        the storage are removed.
+        """
+        if digest is None:
+            return None
+
+        media_hash = self.get_queryset().select_related(
+            'media_file__imagefile', 'media_file__videofile'
+        ).filter(digest=digest, kind=kind).first()
+
+        if media_hash is None:
+            return None
+
+        try:
+            stored_file = media_hash.stored_file
+        except ObjectDoesNotExist:
+            stored_file = None
+
+        if not stored_file or not stored_file.storage.exists(stored_file.name):
+            media_hash.delete()
+            return None
+
+        return media_hash
+
+    def record(self, digest, kind, media_file):
+        """
+        Records the digest of a newly stored file. A digest recorded by a
+        concurrent upload in the meantime is kept.
+        """
+        if digest is None:
+            return
+
+        try:
+            with transaction.atomic():
+                self.create(digest=digest, kind=kind, media_file=media_file)
+        except IntegrityError:
+            pass
+
+
+class EpiCollectMediaHash(models.Model):
+    """
+    Maps the SHA-256 digest of an uploaded photo or video to the media file
+    that stores it, so that the same content uploaded again is linked to
+    the stored file rather than written and processed again.
+    """
+    KINDS = (
+        ('image', 'image'),
+        ('video', 'video'),
+    )
+
+    digest = models.CharField(max_length=64)
+    kind = models.CharField(max_length=10, choices=KINDS)
+    media_file = models.ForeignKey('contributions.MediaFile')
+
+    objects = EpiCollectMediaHashManager()
+
+    class Meta:
+        unique_together = [['digest', 'kind']]
+
+    @property
+    def stored_file(self):
+        if self.kind == 'image':
+            return self.media_file.imagefile.image
+
+        return self.media_file.videofile.video
+
+
+class EpiCollectSubmissionManager(models.Manager):
+    def get_uploaded(self, project_id, unique_ids):
+        """
+        Returns the set of the given unique IDs that have been uploaded to
+        the project before. Uses the (project, unique_id) index.
+        """
+        unique_ids = set(unique_id for unique_id in unique_ids if unique_id)
+        if not unique_ids:
+            return set()
+
+        return set(self.get_queryset().filter(
+            project_id=project_id,
+            unique_id__in=unique_ids
+        ).values_list('unique_id', flat=True))
+
+    def save_entry(self, project, contribution, unique_id):
+        """
+        Saves the validated contribution and records its `unique_id`.
+        Returns `False`, and rolls the contribution back, if the same entry
+        has been saved by a concurrent upload in the meantime.
+        """
+        try:
+            with transaction.atomic():
+                contribution.save()
+
+                if unique_id:
+                    self.create(
+                        project=project,
+                        unique_id=unique_id,
+                        contribution=contribution.instance
+                    )
+        except IntegrityError:
+            return False
+
+        return True
+
+
+class EpiCollectSubmission(models.Model):
+    """
+    Maps the `unique_id` EpiCollect assigns to an entry to the contribution
+    created for it, so that entries uploaded again are recognised.
+    """
+    project = models.ForeignKey('projects.Project')
+    unique_id = models.CharField(max_length=255)
+    contribution = models.ForeignKey('contributions.observation')
+
+    objects = EpiCollectSubmissionManager()
+
+    class Meta:
+        unique_together = [['project', 'unique_id']]
+
+
+class EpiCollectStagedEntry(models.Model):
+    """
+    An uploaded entry that has not been processed yet. Entries are staged
+    when `EPICOLLECT_ASYNC_UPLOADS` is set and processed by the
+    `process_epicollect_uploads` command.
+    """
+    STATUS = (
+        ('pending', 'pending'),
+        ('failed', 'failed'),
+    )
+
+    project = models.ForeignKey('projects.Project')
+    payload = models.TextField()
+    device_id = models.CharField(max_length=255, null=True, blank=True)
+    status = models.CharField(
+        max_length=20, choices=STATUS, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = models.Manager()
+
+    class Meta:
+        index_together = [['status', 'next_attempt_at']]
+
+
+class EpiCollectExportRowManager(models.Manager):
+    def build_rows(self, project_id, rows):
+        """
+        Returns new, unsaved instances for rows returned by
+        `DataSerializer.get_rows(observations, 'updated_at')`. Rows that
+        cannot be serialised are left out, so that the snapshot is not used
+        for their project.
+        """
+        serializer = DataSerializer()
+        export_rows = []
+
+        for row in rows:
+            try:
+                xml, tsv = serializer.serialize_row_to_fragments(row[:7])
+            except (TypeError, ValueError):
+                continue
+
+            export_rows.append(self.model(
+                observation_id=row[0],
+                project_id=project_id,
+                updated_at=row[7],
+                xml=xml,
+                tsv=tsv
+            ))
+
+        return export_rows
+
+    def refresh(self, project_id, observations):
+        """
+        Serialises the observations again, replaces their rows and returns
+        the number of rows created.
+        """
+        rows = list(DataSerializer().get_rows(observations, 'updated_at'))
+
+        with transaction.atomic():
+            self.get_queryset().filter(
+                observation_id__in=[row[0] for row in rows]).delete()
+            return len(self.bulk_create(self.build_rows(project_id, rows)))
+
+    def refresh_entry(self, observation, created=False):
+        """
+        Replaces the row of a saved observation. The row is serialised from
+        the instance, so that saving an observation does not query it again.
+        Deleted observations, and observations that cannot be serialised,
+        have their row removed.
+        """
+        existing = self.get_queryset().filter(observation_id=observation.id)
+
+        if observation.status == 'deleted':
+            existing.delete()
+            return
+
+        serializer = DataSerializer()
+        try:
+            xml, tsv = serializer.serialize_row_to_fragments(
+                serializer.get_row(observation))
+        except (TypeError, ValueError):
+            existing.delete()
+            return
+
+        values = {
+            'project_id': observation.project_id,
+            'updated_at': observation.updated_at,
+            'xml': xml,
+            'tsv': tsv
+        }
+
+        if created:
+            self.create(observation_id=observation.id, **values)
+        elif not existing.update(**values):
+            try:
+                with transaction.atomic():
+                    self.create(observation_id=observation.id, **values)
+            except IntegrityError:
+                # Created by a concurrent save in the meantime
+                existing.update(**values)
+
+    def rebuild(self, project_id, batch_size):
+        """
+        Replaces all rows of the project, serialising its observations in
+        batches of `batch_size`. Returns the number of rows created. Rows
+        saved for new observations while the snapshot is rebuilt are
+        replaced with their batch.
+        """
+        self.get_queryset().filter(project_id=project_id).delete()
+
+        observations = Observation.objects.prefetch_related(None).filter(
+            project_id=project_id).order_by('id')
+
+        count = 0
+        after_id = 0
+
+        while True:
+            ids = list(observations.filter(id__gt=after_id).values_list(
+                'id', flat=True)[:batch_size])
+            if not ids:
+                break
+
+            count += self.refresh(
+                project_id, Observation.objects.filter(id__in=ids))
+            after_id = ids[-1]
+
+        return count
+
+    def is_current(self, project_id, count):
+        """
+        Returns whether the project's rows match its `count` observations.
+        Each row is compared with the time its observation was last changed,
+        so that a row left outdated, e.g. by an observation changed while
+        the project was disabled, is detected even if a newer change has
+        been stored. Rows that are missing or out of date make the download
+        fall back to serialising the observations.
+        """
+        stats = self.get_queryset().filter(project_id=project_id).aggregate(
+            count=Count('observation_id'),
+            current=Sum(Case(
+                When(
+                    (
+                        Q(updated_at=F('observation__updated_at')) |
+                        Q(updated_at__isnull=True,
+                          observation__updated_at__isnull=True)
+                    ) &
+                    Q(observation__project_id=project_id) &
+                    ~Q(observation__status='deleted'),
+                    then=Value(1)
+                ),
+                default=Value(0),
+                output_field=IntegerField()
+            ))
+        )
+
+        return stats['count'] == count and (stats['current'] or 0) == count
+
+    def get_fragments(self, project_id, format):
+        """
+        Returns an iterator over the project's stored `xml` or `tsv`
+        fragments, in the order observations are downloaded in.
+        """
+        return self.get_queryset().filter(project_id=project_id).order_by(
+            '-updated_at', 'observation_id'
+        ).values_list(format, flat=True).iterator()
+
+
+class EpiCollectExportRow(models.Model):
+    """
+    The serialised XML entry and TSV line of an observation of an EpiCollect
+    project. Rows are updated when observations are saved, so that a full
+    download concatenates them rather than serialising every observation.
+    """
+    observation = models.OneToOneField(
+        'contributions.Observation',
+        primary_key=True,
+        related_name='+'
+    )
+    project = models.ForeignKey('projects.Project', related_name='+')
+    updated_at = models.DateTimeField(null=True)
+    xml = models.TextField()
+    tsv = models.TextField()
+
+    objects = EpiCollectExportRowManager()
+
+    class Meta:
+        index_together = [['project', 'updated_at']]
+
+
+LOOKUP_CACHE_TIMEOUT = getattr(settings, 'EPICOLLECT_LOOKUP_CACHE_TIMEOUT', 60)
+LOOKUP_CACHE_SIZE = getattr(settings, 'EPICOLLECT_LOOKUP_CACHE_SIZE', 1024)
+
+project_cache = TTLCache(LOOKUP_CACHE_TIMEOUT, LOOKUP_CACHE_SIZE)
+user_cache = TTLCache(LOOKUP_CACHE_TIMEOUT)
+
+
+def get_enabled_project(project_id):
+    """
+    Returns the project if it is enabled for EpiCollect, otherwise `None`.
+    The result is cached in the process for `EPICOLLECT_LOOKUP_CACHE_TIMEOUT`
+    seconds, or until the project or its EpiCollect settings change. Cached
+    projects are stamped with the schema version they were loaded at and
+    reloaded once it has been replaced, so that changes made by other
+    processes are seen as well.
+    """
+    project_id = int(project_id)
+
+    def load():
+        # The version is read before the project, so that a change made in
+        # between replaces it again. It is not created here, so that
+        # arbitrary IDs do not add versions to the cache.
+        version = get_cache().get(get_version_key('schema', project_id))
+
+        try:
+            epicollect = EpiCollectProject.objects.select_related(
+                'project').get(pk=project_id)
+        except EpiCollectProject.DoesNotExist:
+            return None
+
+        return (epicollect.project, version) if epicollect.enabled else None
+
+    item = project_cache.get_or_set(project_id, load)
+
+    if item is not None and item[1] != get_schema_version(project_id):
+        project_cache.discard(project_id)
+        item = project_cache.get_or_set(project_id, load)
+
+    return item[0] if item is not None else None
+
+
+def get_anonymous_user():
+    """
+    Returns the user that uploads are attributed to. The user is cached in
+    the process like enabled projects are.
+    """
+    return user_cache.get_or_set(
+        'AnonymousUser',
+        lambda: User.objects.get(display_name='AnonymousUser')
+    )
+
+
+def get_schema_project_id(instance):
+    """
+    Returns the ID of the project whose EcML form depends on the instance, or
+    `None` if the instance is not part of a form.
+    """
+    if isinstance(instance, Project):
+        return instance.id
+    elif isinstance(instance, EpiCollectProject):
+        # Enabled projects are stamped with the schema version
+        return instance.project_id
+    elif isinstance(instance, Category):
+        return instance.project_id
+    elif isinstance(instance, Field):
+        return instance.category.project_id
+    elif isinstance(instance, (LookupValue, MultipleLookupValue)):
+        return instance.field.category.project_id
+
+
+def get_data_project_ids(instance, created=False):
+    """
+    Returns the IDs of all projects whose downloads depend on the instance.
+    """
+    if isinstance(instance, Observation):
+        return [instance.project_id]
+    elif isinstance(instance, Location) and not created:
+        # A location that has just been created is not used by any
+        # observation yet
+        return set(instance.locations.values_list('project_id', flat=True))
+
+    return []
+
+
+@receiver(post_save)
+@receiver(post_delete)
+def update_versions(sender, instance, **kwargs):
+    """
+    Receiver that is called after any model is saved or deleted. Replaces
+    the schema version of the project if the instance is part of its form,
+    and the data version of all projects whose downloads include it. Fields
+    are connected without a sender because their subclasses, not `Field`,
+    send the signals.
+    """
+    try:
+        project_id = get_schema_project_id(instance)
+    except ObjectDoesNotExist:
+        # The parent has been deleted as well and sends its own signal
+        project_id = None
+
+    if project_id is not None:
+        bump_schema_version(project_id)
+        invalidate_category_schemas(project_id)
+
+    for project_id in get_data_project_ids(instance, kwargs.get('created')):
+        bump_data_version(project_id)
+
+
+@receiver(post_save)
+@receiver(post_delete)
+def update_lookup_caches(sender, instance, **kwargs):
+    """
+    Receiver that is called after any model is saved or deleted. Removes
+    cached projects and the cached anonymous user when they change.
+    """
+    if isinstance(instance, EpiCollectProject):
+        project_cache.discard(instance.project_id)
+    elif isinstance(instance, Project):
+        project_cache.discard(instance.id)
+    elif isinstance(instance, User):
+        user_cache.clear()
+
+
+@receiver(post_save, sender=Observation)
+def update_export_row(sender, instance, created, **kwargs):
+    """
+    Receiver that is called after an observation is saved. Replaces its row
+    in the export snapshot if its project is enabled for EpiCollect. Rows of
+    deleted observations are deleted with them.
+    """
+    if get_enabled_project(instance.project_id) is not None:
+        EpiCollectExportRow.objects.refresh_entry(instance, created)
+
+
+@receiver(post_save, sender=EpiCollectProject)
+def delete_export_rows(sender, instance, **kwargs):
+    """
+    Receiver that is called after EpiCollect settings are saved. Deletes the
+    export rows of a disabled project, as they are not updated while it is
+    disabled.
+    """
+    if not instance.enabled:
+        EpiCollectExportRow.objects.filter(
+            project_id=instance.project_id).delete()
+
+
+@receiver(post_save, sender=Location)
+def update_location_export_rows(sender, instance, created, **kwargs):
+    """
+    Receiver that is called after a location is saved. Replaces the rows of
+    the observations at the location, as their coordinates are exported.
+    """
+    if created:
+        return
+
+    project_ids = set(instance.locations.values_list('project_id', flat=True))
+
+    for project_id in project_ids:
+        if get_enabled_project(project_id) is not None:
+            EpiCollectExportRow.objects.refresh(
+                project_id,
+                Observation.objects.filter(
+                    project_id=project_id, location=instance)
+            )
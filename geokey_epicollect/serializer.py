@@ -4,9 +4,17 @@ EpiCollect's mobile app.
 """
 import calendar
 from django.core.urlresolvers import reverse
+from django.db.models import (
+    F, Func, Prefetch, BigIntegerField, CharField, FloatField,
+    prefetch_related_objects
+)
 
 from lxml import etree
 
+from geokey.categories.models import Field, LookupValue, MultipleLookupValue
+
+from . import metrics
+
 
 class ProjectFormSerializer(object):
     # ########################################################################
@@ -42,7 +50,7 @@ class ProjectFormSerializer(object):
         key = field.key.replace('-', '_')
         base_input = etree.Element(
             'input',
-            ref='%s_%s' % (key, field.category.id)
+            ref='%s_%s' % (key, field.category_id)
         )
 
         if field.required:
@@ -59,7 +67,7 @@ class ProjectFormSerializer(object):
         key = field.key.replace('-', '_')
         base_select = etree.Element(
             type,
-            ref='%s_%s' % (key, field.category.id)
+            ref='%s_%s' % (key, field.category_id)
         )
 
         if field.required:
@@ -67,6 +75,26 @@ class ProjectFormSerializer(object):
 
         return base_select
 
+    def get_active_fields(self, category):
+        """
+        Returns the active fields of a category. Uses the fields prefetched by
+        `get_categories` if available.
+        """
+        try:
+            return category.active_fields
+        except AttributeError:
+            return list(category.fields.filter(status='active'))
+
+    def get_active_lookupvalues(self, field):
+        """
+        Returns the active lookup values of a field. Uses the values
+        prefetched by `get_categories` if available.
+        """
+        try:
+            return field.active_lookupvalues
+        except AttributeError:
+            return field.lookupvalues.filter(status='active')
+
     def get_photo_input(self):
         photo = etree.Element('photo', ref='photo')
         photo.append(self.create_label('Add photo'))
@@ -113,7 +141,7 @@ class ProjectFormSerializer(object):
         element = self.create_base_select(field, 'radio')
         element.append(self.create_label(field.name))
 
-        for value in field.lookupvalues.filter(status='active'):
+        for value in self.get_active_lookupvalues(field):
             element.append(self.create_item(value.name, value.id))
 
         return element
@@ -125,7 +153,7 @@ class ProjectFormSerializer(object):
         element = self.create_base_select(field, 'select')
         element.append(self.create_label(field.name))
 
-        for value in field.lookupvalues.filter(status='active'):
+        for value in self.get_active_lookupvalues(field):
             element.append(self.create_item(value.name, value.id))
 
         return element
@@ -194,31 +222,66 @@ class ProjectFormSerializer(object):
             category_select.append(
                 self.create_item(category.name, category.id))
 
-            for field_idx, field in enumerate(category.fields.filter(
-                    status='active')):
+            fields = self.get_active_fields(category)
+
+            for field_idx, field in enumerate(fields):
                 if type_idx > 0 and field_idx == 0:
                     field_key = field.key.replace('-', '_')
                     jump = category_select.attrib['jump']
                     if len(jump) == 0:
                         jump = ('%s_%s,%s' % (
                             field_key,
-                            field.category.id,
+                            field.category_id,
                             str(type_idx + 1)
                         ))
                     else:
                         jump = jump + ',' + ('%s_%s,%s' % (
                             field_key,
-                            field.category.id,
+                            field.category_id,
                             str(type_idx + 1)
                         ))
                     category_select.attrib['jump'] = jump
 
                 form.append(self.serialize_field(
-                    field, field_idx == (len(category.fields.all()) - 1)
+                    field, field_idx == (len(fields) - 1)
                 ))
 
         return form
 
+    def get_categories(self, project):
+        """
+        Returns the active categories of the project with their active fields
+        and the active values of all lookup fields prefetched. The form is
+        built from a fixed number of queries, however many categories and
+        fields the project has.
+        """
+        categories = list(project.categories.filter(
+            status='active').prefetch_related(Prefetch(
+                'fields',
+                queryset=Field.objects.filter(status='active'),
+                to_attr='active_fields'
+            )))
+
+        fields = [
+            field
+            for category in categories
+            for field in category.active_fields
+        ]
+
+        for fieldtype, model in [
+                ('LookupField', LookupValue),
+                ('MultipleLookupField', MultipleLookupValue)]:
+            prefetch_related_objects(
+                [field for field in fields if field.fieldtype == fieldtype],
+                Prefetch(
+                    'lookupvalues',
+                    queryset=model.objects.filter(status='active'),
+                    to_attr='active_lookupvalues'
+                )
+            )
+
+        return categories
+
     def serialize(self, project, base_url):
         root = etree.Element('ecml', version='1')
 
@@ -242,9 +305,7 @@ class ProjectFormSerializer(object):
         model.append(download)
         root.append(model)
 
-        form = self.serialize_categories(
-            project.categories.filter(status='active')
-        )
+        form = self.serialize_categories(self.get_categories(project))
         form.attrib['name'] = project.name.replace(' ', '_')
         form.attrib['key'] = 'unique_id'
 
@@ -271,92 +332,365 @@ class ProjectFormSerializer(object):
         return root
 
 
+class StreamBuffer(object):
+    """
+    File-like object that collects the output of an incremental writer until
+    it is drained into a streaming response.
+    """
+    def __init__(self):
+        self.chunks = []
+        self.size = 0
+
+    def write(self, data):
+        self.chunks.append(data)
+        self.size += len(data)
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        self.size = 0
+        return data
+
+
+class TagNames(dict):
+    """
+    Maps the property keys of a category to the tag names they are exported
+    as. Each tag name is computed the first time its key is looked up.
+    """
+    def __init__(self, category_id, static_fields):
+        super(TagNames, self).__init__()
+        self.suffix = '_' + str(category_id)
+        self.static_fields = static_fields
+
+    def __missing__(self, key):
+        tag_name = key.replace('-', '_')
+        if key not in self.static_fields:
+            tag_name = tag_name + self.suffix
+
+        self[key] = tag_name
+        return tag_name
+
+
 class DataSerializer(object):
-    static_fields = [
+    # Number of bytes collected before a chunk is handed to the response
+    chunk_size = 64 * 1024
+
+    static_fields = frozenset([
         'unique_id', 'DeviceID', 'location_acc', 'location_provider',
         'location_alt', 'location_bearing'
-    ]
+    ])
 
-    def serialize_entry_to_xml(self, observation):
+    def __init__(self):
+        self.tag_names = {}
+
+    def get_tag_names(self, category_id):
+        """
+        Returns the tag names of the category's property keys. They are kept
+        for the lifetime of the serialiser, i.e. for one export.
+        """
+        tag_names = self.tag_names.get(category_id)
+
+        if tag_names is None:
+            tag_names = TagNames(category_id, self.static_fields)
+            self.tag_names[category_id] = tag_names
+
+        return tag_names
+
+    def get_observations(self, project, since=None):
+        """
+        Returns the observations of the project. Everything the entry
+        serialisers read is joined into the query, so the number of queries
+        does not depend on the number of observations. If `since` is given,
+        only observations created or updated after that time are returned;
+        GeoKey sets `updated_at` when an observation is created, so it is
+        the only column filtered on, using the (project, updated_at) index.
+        """
+        observations = project.observations.prefetch_related(
+            None).select_related('category', 'location', 'project')
+
+        if since is not None:
+            observations = observations.filter(updated_at__gt=since)
+
+        return observations
+
+    def paginate(self, observations, after_id, limit):
+        """
+        Returns the page of at most `limit` observations that follows the
+        observation with ID `after_id`, and the ID to request the next page
+        after (`None` if this is the last page). Pages are selected by ID
+        rather than offset, so the cost does not grow with the page number.
+        """
+        observations = observations.filter(id__gt=after_id).order_by('id')
+        boundary = list(observations.values_list(
+            'id', flat=True)[limit - 1:limit + 1])
+
+        next_after_id = None
+        if len(boundary) == 2:
+            next_after_id = boundary[0]
+
+        return observations[:limit], next_after_id
+
+    def get_rows(self, observations, *fields):
+        """
+        Returns the observations as tuples of the values an entry is
+        serialised from: ID, category ID, properties, longitude, latitude,
+        the upload time in seconds since the epoch and the formatted upload
+        time, followed by the values of `fields`, if any. Coordinates and
+        times are computed by the database, so that neither geometries nor
+        model instances are built per observation.
+        """
+        return observations.annotate(
+            lon=Func(
+                Func(F('location__geometry'), function='ST_Centroid'),
+                function='ST_X',
+                output_field=FloatField()
+            ),
+            lat=Func(
+                Func(F('location__geometry'), function='ST_Centroid'),
+                function='ST_Y',
+                output_field=FloatField()
+            ),
+            created_epoch=Func(
+                F('created_at'),
+                template='CAST(FLOOR(EXTRACT(EPOCH FROM %(expressions)s)) '
+                         'AS bigint)',
+                output_field=BigIntegerField()
+            ),
+            uploaded=Func(
+                F('created_at'),
+                template="to_char(%(expressions)s AT TIME ZONE 'UTC', "
+                         "'YYYY-MM-DD HH24:MI:SS')",
+                output_field=CharField()
+            )
+        ).values_list(
+            'id', 'category_id', 'properties', 'lon', 'lat', 'created_epoch',
+            'uploaded', *fields
+        )
+
+    def get_row(self, observation):
+        """
+        Returns the row of a single observation, as `get_rows` does.
+        """
+        centroid = observation.location.geometry.centroid
+
+        return (
+            observation.id,
+            observation.category_id,
+            observation.properties,
+            centroid.x,
+            centroid.y,
+            calendar.timegm(observation.created_at.utctimetuple()),
+            observation.created_at.strftime('%Y-%m-%d %H:%M:%S')
+        )
+
+    def serialize_row_to_xml(self, row):
+        (observation_id, category_id, properties, lon, lat, created_epoch,
+         uploaded_at) = row
         entry = etree.Element('entry')
 
         id = etree.Element('id')
-        id.text = str(observation.id)
+        id.text = str(observation_id)
         entry.append(id)
 
-        location_lon = created = etree.Element('location_lon')
-        location_lon.text = str(observation.location.geometry.x)
+        location_lon = etree.Element('location_lon')
+        location_lon.text = str(lon)
         entry.append(location_lon)
 
-        location_lat = created = etree.Element('location_lat')
-        location_lat.text = str(observation.location.geometry.y)
+        location_lat = etree.Element('location_lat')
+        location_lat.text = str(lat)
         entry.append(location_lat)
 
         created = etree.Element('created')
-        created.text = str(calendar.timegm(
-            observation.created_at.utctimetuple()))
+        created.text = str(created_epoch)
         entry.append(created)
 
         uploaded = etree.Element('uploaded')
-        uploaded.text = observation.created_at.strftime('%Y-%m-%d %H:%M:%S')
+        uploaded.text = uploaded_at
         entry.append(uploaded)
 
-        for key, value in observation.properties.iteritems():
-            tag_name = key.replace('-', '_')
-            if key not in self.static_fields:
-                tag_name = tag_name + '_' + str(observation.category.id)
-            el = etree.Element(tag_name)
+        tag_names = self.get_tag_names(category_id)
+
+        for key, value in properties.iteritems():
+            el = etree.SubElement(entry, tag_names[key])
 
             if value is not None and len(value) > 0:
                 el.text = value
             else:
                 el.text = 'Null'
 
-            entry.append(el)
-
         return entry
 
-    def serialize_to_xml(self, project):
-        root = etree.Element('entries')
+    def serialize_entry_to_xml(self, observation):
+        return self.serialize_row_to_xml(self.get_row(observation))
+
+    def serialize_row_to_fragments(self, row):
+        """
+        Returns the `<entry>` element and the TSV line of a row as text, as
+        they are stored in export snapshots. The TSV line is not prefixed
+        with the project name, which can change without the row changing.
+        """
+        return (
+            etree.tostring(self.serialize_row_to_xml(row)).decode('ascii'),
+            self.serialize_row_to_tsv('', row)
+        )
 
+    def serialize_table_to_xml(self, project, meta=None):
+        """
+        Creates the `<table>` element that precedes the entries. `meta` is a
+        list of `(name, value)` tuples that are added as elements, e.g. the
+        cursor for the next delta download.
+        """
         table = etree.Element('table')
         table_name = etree.Element('table_name')
         table_name.text = project.name.replace(' ', '_')
-
         table.append(table_name)
-        root.append(table)
 
-        for observation in project.observations.all():
-            root.append(self.serialize_entry_to_xml(observation))
+        for name, value in meta or []:
+            element = etree.Element(name)
+            element.text = str(value)
+            table.append(element)
+
+        return table
+
+    def serialize_to_xml(self, project, observations=None, meta=None):
+        if observations is None:
+            observations = self.get_observations(project)
+
+        root = etree.Element('entries')
+        root.append(self.serialize_table_to_xml(project, meta))
+
+        for row in self.get_rows(observations):
+            root.append(self.serialize_row_to_xml(row))
 
         return root
 
-    def serialize_entry_to_tsv(self, observation):
-        line = observation.project.name.replace(' ', '_') + '\t'
+    def stream_xml(self, project, observations=None, meta=None):
+        """
+        Serialises the observations of the project (all of them unless
+        `observations` is given) and yields the document in chunks.
+        `<entry>` elements are written one at a time so that the whole tree
+        is never held in memory; the output is identical to
+        `etree.tostring(self.serialize_to_xml(...))`.
+        """
+        if observations is None:
+            observations = self.get_observations(project)
 
-        line = line + 'id\t' + str(observation.id) + '\t'
-        line = line + 'location_lon\t' + str(observation.location.geometry.x) + '\t'
-        line = line + 'location_lat\t' + str(observation.location.geometry.y) + '\t'
-        line = line + 'created\t' + str(calendar.timegm(observation.created_at.utctimetuple())) + '\t'
-        line = line + 'uploaded\t' + observation.created_at.strftime('%Y-%m-%d %H:%M:%S') + '\t'
+        output = StreamBuffer()
 
-        for key, value in observation.properties.iteritems():
-            tag_name = key.replace('-', '_')
-            if key not in self.static_fields:
-                tag_name = tag_name + '_' + str(observation.category.id)
+        with etree.xmlfile(output, buffered=False) as xf:
+            with xf.element('entries'):
+                xf.write(self.serialize_table_to_xml(project, meta))
+                yield output.drain()
 
+                rows = 0
+                for row in self.get_rows(observations).iterator():
+                    xf.write(self.serialize_row_to_xml(row))
+                    rows += 1
+
+                    if output.size >= self.chunk_size:
+                        yield output.drain()
+
+        yield output.drain()
+        metrics.increment(
+            'epicollect_rows_serialized_total', rows, format='xml')
+
+    def stream_xml_fragments(self, project, fragments):
+        """
+        Yields the document of the project from stored `<entry>` fragments
+        in chunks, without serialising the entries. The output is identical
+        to `stream_xml(project)` for the same entries.
+        """
+        output = StreamBuffer()
+        output.write(b'<entries>')
+        output.write(etree.tostring(self.serialize_table_to_xml(project)))
+        yield output.drain()
+
+        for fragment in fragments:
+            output.write(fragment.encode('ascii'))
+
+            if output.size >= self.chunk_size:
+                yield output.drain()
+
+        output.write(b'</entries>')
+        yield output.drain()
+
+    def serialize_row_to_tsv(self, project_name, row):
+        (observation_id, category_id, properties, lon, lat, created_epoch,
+         uploaded_at) = row
+        line = [
+            project_name,
+            'id', str(observation_id),
+            'location_lon', str(lon),
+            'location_lat', str(lat),
+            'created', str(created_epoch),
+            'uploaded', uploaded_at
+        ]
+
+        tag_names = self.get_tag_names(category_id)
+
+        for key, value in properties.iteritems():
             val = value
             if value is None or len(value) == 0:
                 val = 'Null'
 
-            line = line + tag_name + '\t' + val + '\t'
+            line.append(tag_names[key])
+            line.append(val)
+
+        line.append('\n')
+        return '\t'.join(line)
+
+    def serialize_entry_to_tsv(self, observation):
+        return self.serialize_row_to_tsv(
+            observation.project.name.replace(' ', '_'),
+            self.get_row(observation)
+        )
+
+    def serialize_meta_to_tsv(self, meta):
+        """
+        Serialises `(name, value)` tuples as lines following the entries.
+        """
+        return ''.join(
+            '%s\t%s\t\n' % (name, value) for name, value in meta or [])
+
+    def serialize_to_tsv(self, project, observations=None, meta=None):
+        if observations is None:
+            observations = self.get_observations(project)
+
+        project_name = project.name.replace(' ', '_')
 
-        return line + '\n'
+        return ''.join(
+            self.serialize_row_to_tsv(project_name, row)
+            for row in self.get_rows(observations)
+        ) + self.serialize_meta_to_tsv(meta)
+
+    def stream_tsv(self, project, observations=None, meta=None):
+        """
+        Serialises the observations of the project (all of them unless
+        `observations` is given) and yields one UTF-8 encoded line per
+        observation. The output is identical to `serialize_to_tsv(...)`.
+        """
+        if observations is None:
+            observations = self.get_observations(project)
 
-    def serialize_to_tsv(self, project):
-        tsv = ''
+        project_name = project.name.replace(' ', '_')
 
-        for observation in project.observations.all():
-            tsv = tsv + self.serialize_entry_to_tsv(observation)
+        rows = 0
+        for row in self.get_rows(observations).iterator():
+            yield self.serialize_row_to_tsv(project_name, row).encode('utf-8')
+            rows += 1
+
+        metrics.increment(
+            'epicollect_rows_serialized_total', rows, format='tsv')
+
+        if meta:
+            yield self.serialize_meta_to_tsv(meta).encode('utf-8')
+
+    def stream_tsv_fragments(self, project, fragments):
+        """
+        Yields the lines of the project from stored TSV fragments. The output
+        is identical to `stream_tsv(project)` for the same entries.
+        """
+        project_name = project.name.replace(' ', '_')
 
-        return tsv
+        for fragment in fragments:
+            yield (project_name + fragment).encode('utf-8')
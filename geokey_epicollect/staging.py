@@ -0,0 +1,159 @@
+"""
+Asynchronous ingestion of uploaded entries. With `EPICOLLECT_ASYNC_UPLOADS`
+set, the upload view only stores the form data of an entry in the staging
+table and answers at once. The `process_epicollect_uploads` command converts
+and saves staged entries in batches, grouped by project and category, and
+retries entries that fail with exponential backoff.
+"""
+import json
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from geokey.projects.models import Project
+
+from .models import (
+    EpiCollectMedia,
+    EpiCollectStagedEntry,
+    EpiCollectSubmission,
+    get_anonymous_user
+)
+from .upload import get_contribution_serializer
+
+
+MAX_ATTEMPTS = getattr(settings, 'EPICOLLECT_STAGING_MAX_ATTEMPTS', 5)
+RETRY_DELAY = getattr(settings, 'EPICOLLECT_STAGING_RETRY_DELAY', 60)
+MAX_RETRY_DELAY = 24 * 60 * 60
+
+
+def stage_entry(project, data, device_id):
+    """
+    Stores the form data of an uploaded entry for processing.
+    """
+    return EpiCollectStagedEntry.objects.create(
+        project=project,
+        payload=json.dumps(data),
+        device_id=device_id
+    )
+
+
+def get_retry_delay(attempts):
+    """
+    Returns the time to wait after the given number of failed attempts. The
+    delay doubles with each attempt, up to a day.
+    """
+    return timedelta(
+        seconds=min(RETRY_DELAY * 2 ** (attempts - 1), MAX_RETRY_DELAY))
+
+
+def get_group_key(entry):
+    return entry.project_id, entry.data.get('category'), entry.id
+
+
+def process_entry(project, entry, user, uploaded):
+    """
+    Converts and saves a staged entry and returns its pending media files.
+    Raises an exception if the entry cannot be saved.
+    """
+    unique_id = entry.data.get('unique_id')
+    if unique_id in uploaded:
+        return []
+
+    contribution = get_contribution_serializer(
+        project, user, entry.data, entry.device_id)
+    contribution.is_valid(raise_exception=True)
+
+    saved = EpiCollectSubmission.objects.save_entry(
+        project, contribution, unique_id)
+
+    if unique_id:
+        uploaded.add(unique_id)
+
+    if not saved:
+        return []
+
+    return EpiCollectMedia.objects.for_entry(
+        project, contribution.instance, entry.data)
+
+
+def record_failure(entry, error, now):
+    entry.attempts += 1
+    entry.last_error = '%s: %s' % (type(error).__name__, error)
+
+    if entry.attempts >= MAX_ATTEMPTS:
+        entry.status = 'failed'
+    else:
+        entry.next_attempt_at = now + get_retry_delay(entry.attempts)
+
+    entry.save(update_fields=[
+        'attempts', 'last_error', 'status', 'next_attempt_at'])
+
+
+def process_staged_entries(batch_size=100):
+    """
+    Processes a batch of staged entries that are due. Saved entries are
+    removed from the staging table; entries that fail are retried later or,
+    after `EPICOLLECT_STAGING_MAX_ATTEMPTS` attempts, marked as failed.
+    Entries locked by another worker are skipped where the database supports
+    it, otherwise workers wait for each other. Returns the number of entries
+    processed.
+    """
+    now = timezone.now()
+    user = get_anonymous_user()
+
+    # SKIP LOCKED needs PostgreSQL 9.5
+    skip_locked = connection.features.has_select_for_update_skip_locked
+
+    with transaction.atomic():
+        entries = list(EpiCollectStagedEntry.objects.select_for_update(
+            skip_locked=skip_locked
+        ).filter(
+            status='pending',
+            next_attempt_at__lte=now
+        ).order_by('id')[:batch_size])
+
+        for entry in entries:
+            entry.data = json.loads(entry.payload)
+
+        projects = Project.objects.in_bulk(
+            set(entry.project_id for entry in entries))
+        uploaded = {}
+        processed = []
+        media = []
+
+        # Entries of the same category are processed together, so that its
+        # upload schema is compiled once
+        for entry in sorted(entries, key=get_group_key):
+            if entry.project_id not in uploaded:
+                uploaded[entry.project_id] = (
+                    EpiCollectSubmission.objects.get_uploaded(
+                        entry.project_id,
+                        [e.data.get('unique_id') for e in entries
+                         if e.project_id == entry.project_id]
+                    )
+                )
+
+            # Each entry has its own savepoint, so that an entry that fails,
+            # however it fails, is rolled back and recorded without
+            # aborting the batch
+            try:
+                with transaction.atomic():
+                    entry_media = process_entry(
+                        projects[entry.project_id],
+                        entry,
+                        user,
+                        uploaded[entry.project_id]
+                    )
+            except Exception as error:
+                record_failure(entry, error, now)
+            else:
+                media.extend(entry_media)
+                processed.append(entry.id)
+
+        EpiCollectMedia.objects.bulk_create(media)
+        EpiCollectStagedEntry.objects.filter(id__in=processed).delete()
+
+    return len(entries)
@@ -0,0 +1,279 @@
+"""
+Benchmarks for the form, download and upload endpoints. Synthetic projects
+are built with GeoKey's model factories; for each size, the form and data
+serialisers and the upload view are timed, and their query counts and peak
+memory are recorded.
+
+The module is not collected by the test runner. Run the benchmarks with
+`python travis_ci/benchmark.py`, which creates a test database and writes the
+results as JSON.
+"""
+import gc
+import sys
+import time
+import platform
+import resource
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+from django.db import connection
+from django.core.urlresolvers import reverse
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.http import urlencode
+
+from rest_framework.test import APIRequestFactory
+
+from geokey.users.models import User
+from geokey.users.tests.model_factories import UserFactory
+from geokey.projects.models import Project
+from geokey.projects.tests.model_factories import ProjectFactory
+from geokey.categories.tests.model_factories import (
+    CategoryFactory, TextFieldFactory, LookupFieldFactory, LookupValueFactory
+)
+from geokey.contributions.tests.model_factories import (
+    LocationFactory, ObservationFactory
+)
+
+from .. import __version__
+from ..models import EpiCollectProject, project_cache, user_cache
+from ..serializer import ProjectFormSerializer, DataSerializer
+from ..views import EpiCollectUploadView
+
+
+SIZES = {
+    'small': {
+        'categories': 2,
+        'fields': 5,
+        'lookup_values': 5,
+        'observations': 100,
+        'uploads': 10
+    },
+    'medium': {
+        'categories': 5,
+        'fields': 20,
+        'lookup_values': 20,
+        'observations': 2000,
+        'uploads': 50
+    },
+    'large': {
+        'categories': 10,
+        'fields': 40,
+        'lookup_values': 50,
+        'observations': 20000,
+        'uploads': 100
+    }
+}
+
+
+def build_project(categories, fields, lookup_values, observations, **kwargs):
+    """
+    Creates a project enabled for EpiCollect with the given number of
+    categories and, per category, text fields, one lookup field with the
+    given number of values, and observations.
+    """
+    creator = UserFactory.create()
+    project = ProjectFactory.create(**{
+        'creator': creator,
+        'isprivate': False,
+        'everyone_contributes': True
+    })
+    EpiCollectProject.objects.create(project=project, enabled=True)
+    location = LocationFactory.create(**{'creator': creator})
+
+    per_category = observations // categories
+
+    for index in range(categories):
+        category = CategoryFactory.create(**{
+            'project': project,
+            'creator': creator
+        })
+        text_fields = TextFieldFactory.create_batch(
+            fields, **{'category': category})
+
+        lookup = LookupFieldFactory.create(**{'category': category})
+        LookupValueFactory.create_batch(lookup_values, **{'field': lookup})
+
+        properties = dict(
+            (field.key, 'value of %s' % field.key) for field in text_fields)
+        ObservationFactory.create_batch(per_category, **{
+            'project': project,
+            'category': category,
+            'location': location,
+            'creator': creator,
+            'properties': properties
+        })
+
+    return Project.objects.get(pk=project.id)
+
+
+def get_upload_data(category):
+    """
+    Returns the form data EpiCollect uploads for an entry of the category.
+    """
+    data = {
+        'location_lat': '51.5175205',
+        'location_lon': '-0.1729205',
+        'location_acc': '20',
+        'category': str(category.id)
+    }
+
+    for field in category.fields.all():
+        if field.fieldtype == 'TextField':
+            data['%s_%s' % (field.key, category.id)] = 'Westbourne Park'
+
+    return data
+
+
+def get_peak_memory(func):
+    """
+    Calls the function and returns the peak memory it allocated, in bytes.
+    Without `tracemalloc` (Python 2), the growth of the process' peak RSS is
+    returned instead, which is 0 if the peak was reached earlier.
+    """
+    gc.collect()
+
+    if tracemalloc is not None:
+        tracemalloc.start()
+        try:
+            func()
+            return tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    unit = 1 if sys.platform == 'darwin' else 1024
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    func()
+    after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return (after - before) * unit
+
+
+def measure(func, repeat=3):
+    """
+    Calls the function `repeat` times and returns the fastest time in
+    seconds, the number of queries of one call and its peak memory.
+    """
+    timings = []
+
+    for i in range(repeat):
+        started = time.time()
+        func()
+        timings.append(time.time() - started)
+
+    with CaptureQueriesContext(connection) as context:
+        func()
+
+    return {
+        'seconds': min(timings),
+        'queries': len(context.captured_queries),
+        'peak_memory': get_peak_memory(func)
+    }
+
+
+def benchmark_form(project):
+    serializer = ProjectFormSerializer()
+    return measure(lambda: serializer.serialize(project, 'localhost'))
+
+
+def benchmark_download(project):
+    return {
+        'xml': measure(lambda: DataSerializer().serialize_to_xml(project)),
+        'tsv': measure(lambda: DataSerializer().serialize_to_tsv(project))
+    }
+
+
+def benchmark_rows(project):
+    """
+    Times the serialisation of single rows, without the queries, and
+    returns the seconds per row for each format.
+    """
+    serializer = DataSerializer()
+    rows = list(serializer.get_rows(serializer.get_observations(project)))
+    project_name = project.name.replace(' ', '_')
+
+    def per_row(func):
+        timings = []
+        for i in range(3):
+            started = time.time()
+            for row in rows:
+                func(row)
+            timings.append(time.time() - started)
+
+        return min(timings) / len(rows)
+
+    return {
+        'xml': per_row(serializer.serialize_row_to_xml),
+        'tsv': per_row(
+            lambda row: serializer.serialize_row_to_tsv(project_name, row))
+    }
+
+
+def benchmark_upload(project, uploads):
+    """
+    Times uploads of `uploads` entries, one request each, and returns the
+    measurements per upload.
+    """
+    if not User.objects.filter(display_name='AnonymousUser').exists():
+        UserFactory.create(display_name='AnonymousUser')
+
+    factory = APIRequestFactory()
+    view = EpiCollectUploadView.as_view()
+    url = reverse('geokey_epicollect:upload', kwargs={
+        'project_id': project.id
+    })
+    data = [
+        get_upload_data(category)
+        for category in project.categories.prefetch_related('fields')
+    ]
+
+    def upload():
+        for index in range(uploads):
+            request = factory.post(
+                url + '?type=data&phoneid=benchmark',
+                urlencode(data[index % len(data)]),
+                content_type='application/x-www-form-urlencoded'
+            )
+            response = view(request, project_id=project.id)
+            assert response.content == '1', response.content
+
+    result = measure(upload, repeat=1)
+    result['seconds'] = result['seconds'] / uploads
+    result['queries'] = float(result['queries']) / uploads
+    return result
+
+
+def run(sizes=None):
+    """
+    Runs the benchmarks for the given sizes (all of `SIZES` by default) and
+    returns the results.
+    """
+    results = {}
+
+    for name in sizes or sorted(SIZES):
+        size = SIZES[name]
+        project_cache.clear()
+        user_cache.clear()
+
+        started = time.time()
+        project = build_project(**size)
+
+        results[name] = {
+            'size': size,
+            'setup_seconds': time.time() - started,
+            'form': benchmark_form(project),
+            'download': benchmark_download(project),
+            'rows': benchmark_rows(project),
+            'upload': benchmark_upload(project, size['uploads'])
+        }
+
+    return {
+        'version': __version__,
+        'python': platform.python_version(),
+        'memory': 'tracemalloc' if tracemalloc is not None else 'maxrss',
+        'created': timezone.now().isoformat(),
+        'results': results
+    }
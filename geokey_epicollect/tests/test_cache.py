@@ -0,0 +1,183 @@
+import shutil
+import tempfile
+
+from django.core.cache import cache
+from django.db import models
+from django.test import TestCase, override_settings
+
+from geokey.projects.tests.model_factories import ProjectFactory
+from geokey.categories.tests.model_factories import (
+    CategoryFactory, TextFieldFactory, LookupFieldFactory, LookupValueFactory
+)
+
+from .. import cache as cache_module
+from ..cache import (
+    LRUCache, TTLCache, is_shared_cache, get_version_timeout,
+    get_schema_version, bump_schema_version, get_cached_form, set_cached_form
+)
+
+
+LOCMEM_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class FormCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_get_schema_version(self):
+        version = get_schema_version(1)
+        self.assertIsNotNone(version)
+        self.assertEqual(get_schema_version(1), version)
+        self.assertNotEqual(get_schema_version(2), version)
+
+    def test_bump_schema_version(self):
+        version = get_schema_version(1)
+        bump_schema_version(1)
+        self.assertNotEqual(get_schema_version(1), version)
+
+    def test_cached_form(self):
+        version = get_schema_version(1)
+        self.assertIsNone(get_cached_form(1, 'localhost', version))
+
+        set_cached_form(1, 'localhost', version, '<ecml/>')
+        self.assertEqual(get_cached_form(1, 'localhost', version), '<ecml/>')
+        self.assertIsNone(get_cached_form(1, 'example.com', version))
+
+        bump_schema_version(1)
+        self.assertIsNone(
+            get_cached_form(1, 'localhost', get_schema_version(1)))
+
+    def test_local_cache(self):
+        self.assertFalse(is_shared_cache())
+        self.assertEqual(
+            get_version_timeout(), cache_module.LOCAL_CACHE_TIMEOUT)
+
+        # Versions kept by this process expire, so that changes made in
+        # other processes are picked up
+        timeout = cache_module.LOCAL_CACHE_TIMEOUT
+        cache_module.LOCAL_CACHE_TIMEOUT = 0
+        try:
+            version = get_schema_version(1)
+            self.assertNotEqual(get_schema_version(1), version)
+        finally:
+            cache_module.LOCAL_CACHE_TIMEOUT = timeout
+
+    def test_shared_cache(self):
+        directory = tempfile.mkdtemp()
+        try:
+            with override_settings(CACHES={'default': {
+                'BACKEND': 'django.core.cache.backends.filebased.'
+                           'FileBasedCache',
+                'LOCATION': directory
+            }}):
+                self.assertTrue(is_shared_cache())
+                self.assertIsNone(get_version_timeout())
+        finally:
+            shutil.rmtree(directory)
+
+
+class LRUCacheTest(TestCase):
+    def test_least_recently_used_evicted(self):
+        lru = LRUCache(2)
+        lru.set('a', 1)
+        lru.set('b', 2)
+        lru.get('a')
+        lru.set('c', 3)
+
+        self.assertEqual(lru.get('a'), 1)
+        self.assertIsNone(lru.get('b'))
+        self.assertEqual(lru.get('c'), 3)
+
+    def test_discard(self):
+        lru = LRUCache(5)
+        for value in range(5):
+            lru.set(value, value)
+
+        lru.discard(lambda value: value % 2 == 0)
+        self.assertEqual(sorted(lru.items.keys()), [1, 3])
+
+    def test_expired(self):
+        lru = LRUCache(5, timeout=0)
+        lru.set('a', 1)
+        self.assertIsNone(lru.get('a'))
+        self.assertEqual(len(lru.items), 0)
+
+
+class TTLCacheTest(TestCase):
+    def test_get_or_set(self):
+        ttl = TTLCache(60)
+        loads = []
+
+        def load():
+            loads.append(1)
+            return None
+
+        self.assertIsNone(ttl.get_or_set('key', load))
+        self.assertIsNone(ttl.get_or_set('key', load))
+        self.assertEqual(len(loads), 1)
+        self.assertEqual(ttl.hit_rate, 0.5)
+
+        ttl.discard('key')
+        ttl.get_or_set('key', load)
+        self.assertEqual(len(loads), 2)
+
+    def test_expired(self):
+        ttl = TTLCache(0)
+        self.assertEqual(ttl.get_or_set('key', lambda: 1), 1)
+        self.assertEqual(ttl.get_or_set('key', lambda: 2), 2)
+        self.assertEqual(ttl.stats()['misses'], 2)
+
+    def test_size(self):
+        ttl = TTLCache(60, 2)
+        ttl.get_or_set('a', lambda: 1)
+        ttl.get_or_set('b', lambda: 2)
+        ttl.get_or_set('a', lambda: 3)
+        ttl.get_or_set('c', lambda: 4)
+
+        self.assertEqual(ttl.stats()['items'], 2)
+        self.assertEqual(ttl.get_or_set('a', lambda: 5), 1)
+        self.assertEqual(ttl.get_or_set('b', lambda: 6), 6)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class SchemaSignalsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.project = ProjectFactory.create()
+        self.category = CategoryFactory.create(**{'project': self.project})
+
+    def assertVersionBumped(self, func):
+        version = get_schema_version(self.project.id)
+        func()
+        self.assertNotEqual(get_schema_version(self.project.id), version)
+
+    def test_project_saved(self):
+        self.assertVersionBumped(lambda: self.project.save())
+
+    def test_category_saved(self):
+        self.assertVersionBumped(lambda: self.category.save())
+
+    def test_field_saved(self):
+        self.assertVersionBumped(
+            lambda: TextFieldFactory.create(**{'category': self.category}))
+
+    def test_field_deleted(self):
+        field = TextFieldFactory.create(**{'category': self.category})
+        self.assertVersionBumped(
+            lambda: models.Model.delete(field))
+
+    def test_lookup_value_saved(self):
+        field = LookupFieldFactory.create(**{'category': self.category})
+        self.assertVersionBumped(
+            lambda: LookupValueFactory.create(**{'field': field}))
+
+    def test_other_project_not_bumped(self):
+        other = CategoryFactory.create()
+        version = get_schema_version(self.project.id)
+        other.save()
+        self.assertEqual(get_schema_version(self.project.id), version)
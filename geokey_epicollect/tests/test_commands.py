@@ -0,0 +1,139 @@
+from datetime import timedelta
+
+from django.test import TestCase
+from django.utils import timezone
+
+from geokey.users.models import User
+from geokey.users.tests.model_factories import UserFactory
+from geokey.projects.tests.model_factories import ProjectFactory
+from geokey.categories.tests.model_factories import CategoryFactory
+from geokey.contributions.tests.model_factories import ObservationFactory
+
+from ..models import (
+    EpiCollectProject as EpiCollectProjectModel, EpiCollectSubmission,
+    EpiCollectStagedEntry, EpiCollectMedia, EpiCollectExportRow, user_cache
+)
+from ..staging import stage_entry
+from ..management.commands.backfill_epicollect_submissions import (
+    Command as BackfillSubmissions
+)
+from ..management.commands.process_epicollect_uploads import (
+    Command as ProcessUploads
+)
+from ..management.commands.compact_epicollect_media import (
+    Command as CompactMedia
+)
+from ..management.commands.rebuild_epicollect_exports import (
+    Command as RebuildExports
+)
+
+
+class BackfillSubmissionsTest(TestCase):
+    def test_backfill(self):
+        project = ProjectFactory.create()
+        other = ProjectFactory.create()
+        EpiCollectProjectModel.objects.create(project=project, enabled=True)
+
+        first = ObservationFactory.create(**{
+            'project': project,
+            'properties': {'unique_id': 'abc'}
+        })
+        ObservationFactory.create(**{
+            'project': project,
+            'properties': {'unique_id': 'abc'}
+        })
+        recorded = ObservationFactory.create(**{
+            'project': project,
+            'properties': {'unique_id': 'def'}
+        })
+        ObservationFactory.create(**{'project': project, 'properties': {}})
+        ObservationFactory.create(**{
+            'project': other,
+            'properties': {'unique_id': 'ghi'}
+        })
+        EpiCollectSubmission.objects.create(
+            project=project,
+            unique_id='def',
+            contribution=recorded
+        )
+
+        BackfillSubmissions().handle(batch_size=1)
+
+        self.assertEqual(EpiCollectSubmission.objects.count(), 2)
+        self.assertEqual(
+            EpiCollectSubmission.objects.get(unique_id='abc').contribution,
+            first
+        )
+        self.assertFalse(
+            EpiCollectSubmission.objects.filter(project=other).exists())
+
+
+class ProcessUploadsTest(TestCase):
+    def test_process_uploads(self):
+        user_cache.clear()
+        if not User.objects.filter(display_name='AnonymousUser').exists():
+            UserFactory.create(display_name='AnonymousUser')
+
+        project = ProjectFactory.create(
+            **{'isprivate': False, 'everyone_contributes': True}
+        )
+        category = CategoryFactory.create(**{'project': project})
+
+        for unique_id in range(3):
+            stage_entry(project, {
+                'location_lat': '51.5175205',
+                'location_lon': '-0.1729205',
+                'category': str(category.id),
+                'unique_id': str(unique_id)
+            }, None)
+
+        ProcessUploads().handle(batch_size=2, wait=None)
+
+        self.assertEqual(EpiCollectStagedEntry.objects.count(), 0)
+        self.assertEqual(project.observations.count(), 3)
+
+
+class CompactMediaTest(TestCase):
+    def test_compact_media(self):
+        project = ProjectFactory.create()
+        contribution = ObservationFactory.create(**{'project': project})
+
+        for file_name in ['a.jpg', 'b.jpg', 'c.jpg', 'd.jpg']:
+            EpiCollectMedia.objects.create(
+                project=project,
+                contribution=contribution,
+                file_name=file_name
+            )
+
+        EpiCollectMedia.objects.exclude(file_name='d.jpg').update(
+            created_at=timezone.now() - timedelta(days=31))
+
+        CompactMedia().handle(ttl=30, batch_size=2)
+
+        self.assertEqual(
+            list(EpiCollectMedia.objects.values_list('file_name', flat=True)),
+            ['d.jpg']
+        )
+
+
+class RebuildExportsTest(TestCase):
+    def test_rebuild_exports(self):
+        project = ProjectFactory.create()
+        ObservationFactory.create_batch(3, **{
+            'project': project,
+            'properties': {'key': 'value'}
+        })
+        other = ProjectFactory.create()
+        ObservationFactory.create_batch(2, **{'project': other})
+
+        EpiCollectProjectModel.objects.create(project=project, enabled=True)
+        EpiCollectProjectModel.objects.create(project=other, enabled=False)
+        self.assertFalse(EpiCollectExportRow.objects.exists())
+
+        RebuildExports().handle(project_ids=None, batch_size=2)
+
+        self.assertEqual(
+            set(EpiCollectExportRow.objects.values_list(
+                'observation_id', flat=True)),
+            set(project.observations.values_list('id', flat=True))
+        )
@@ -0,0 +1,29 @@
+from datetime import datetime
+
+from pytz import utc
+
+from django.test import TestCase
+
+from ..cursors import create_cursor, parse_since
+
+
+class CursorTest(TestCase):
+    def test_parse_cursor(self):
+        timestamp = datetime(2016, 5, 4, 12, 30, 15, 250000).replace(
+            tzinfo=utc)
+        cursor = create_cursor(timestamp)
+
+        self.assertNotIn('2016', cursor)
+        self.assertEqual(parse_since(cursor), timestamp)
+
+    def test_parse_epoch_seconds(self):
+        self.assertEqual(
+            parse_since('1462365015'),
+            datetime(2016, 5, 4, 12, 30, 15).replace(tzinfo=utc)
+        )
+
+    def test_parse_invalid_value(self):
+        for value in ['yesterday', create_cursor(datetime.now(utc)) + 'x',
+                      'nan', '1e100']:
+            with self.assertRaises(ValueError):
+                parse_since(value)
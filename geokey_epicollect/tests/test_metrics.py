@@ -0,0 +1,123 @@
+from django.http import Http404
+from django.core.urlresolvers import reverse
+from django.test import TestCase
+
+from rest_framework.test import APIRequestFactory
+
+from geokey.projects.tests.model_factories import ProjectFactory
+from geokey.contributions.tests.model_factories import ObservationFactory
+
+from .. import metrics
+from ..models import EpiCollectProject as EpiCollectProjectModel
+from ..views import EpiCollectDownloadView, EpiCollectMetricsView
+
+
+class MetricsTest(TestCase):
+    def setUp(self):
+        self.enabled = metrics.ENABLED
+        metrics.ENABLED = True
+        metrics.registry.clear()
+
+    def tearDown(self):
+        metrics.ENABLED = self.enabled
+        metrics.registry.clear()
+
+    def test_timer(self):
+        with metrics.timer('upload', 'save'):
+            pass
+
+        output = metrics.registry.render()
+        self.assertIn('# TYPE epicollect_stage_seconds summary', output)
+        self.assertIn(
+            'epicollect_stage_seconds_count{stage="save",view="upload"} 1',
+            output
+        )
+
+    def test_increment(self):
+        metrics.increment('epicollect_uploads_total', type='data')
+        metrics.increment('epicollect_uploads_total', 2, type='data')
+
+        output = metrics.registry.render()
+        self.assertIn('# TYPE epicollect_uploads_total counter', output)
+        self.assertIn('epicollect_uploads_total{type="data"} 3', output)
+
+    def test_count_bytes(self):
+        chunks = metrics.count_bytes(iter(['abc', 'de']), 'download')
+        self.assertEqual(''.join(chunks), 'abcde')
+        self.assertIn(
+            'epicollect_bytes_emitted_total{view="download"} 5',
+            metrics.registry.render()
+        )
+
+    def test_format_labels(self):
+        self.assertEqual(metrics.format_labels([]), '')
+        self.assertEqual(
+            metrics.format_labels([('view', 'a\\b"c\nd'), ('type', 'data')]),
+            '{view="a\\\\b\\"c\\nd",type="data"}'
+        )
+
+    def test_disabled(self):
+        metrics.ENABLED = False
+        chunks = iter(['abc'])
+
+        self.assertIs(metrics.timer('upload', 'save'), metrics.NULL_TIMER)
+        self.assertIs(metrics.count_bytes(chunks, 'download'), chunks)
+        metrics.increment('epicollect_uploads_total', type='data')
+        self.assertEqual(metrics.registry.render(), '\n')
+
+    def test_render_gauges(self):
+        output = metrics.registry.render([
+            ('epicollect_lookup_cache_hits', {'cache': 'project'}, 4)
+        ])
+        self.assertIn('# TYPE epicollect_lookup_cache_hits gauge', output)
+        self.assertIn(
+            'epicollect_lookup_cache_hits{cache="project"} 4', output)
+
+    def test_download(self):
+        project = ProjectFactory.create(**{'isprivate': False})
+        EpiCollectProjectModel.objects.create(project=project, enabled=True)
+        ObservationFactory.create(**{'project': project})
+
+        url = reverse('geokey_epicollect:download', kwargs={
+            'project_id': project.id
+        })
+        request = APIRequestFactory().get(url + '?xml=false')
+        response = EpiCollectDownloadView.as_view()(
+            request, project_id=project.id)
+        content = b''.join(response.streaming_content)
+
+        output = metrics.registry.render()
+        self.assertIn(
+            'epicollect_bytes_emitted_total{format="tsv",view="download"} %s'
+            % len(content),
+            output
+        )
+        self.assertIn(
+            'epicollect_stage_seconds_count{stage="lookup",view="download"} 1',
+            output
+        )
+
+    def test_view(self):
+        metrics.increment('epicollect_uploads_total', type='data')
+
+        request = APIRequestFactory().get(
+            reverse('geokey_epicollect:metrics'))
+        response = EpiCollectMetricsView.as_view()(request)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response['Content-Type'],
+            'text/plain; version=0.0.4; charset=utf-8'
+        )
+        self.assertIn('epicollect_uploads_total{type="data"} 1',
+                      response.content)
+        self.assertIn('epicollect_lookup_cache_hits{cache="project"}',
+                      response.content)
+
+    def test_view_disabled(self):
+        metrics.ENABLED = False
+
+        request = APIRequestFactory().get(
+            reverse('geokey_epicollect:metrics'))
+        with self.assertRaises(Http404):
+            EpiCollectMetricsView.as_view()(request)
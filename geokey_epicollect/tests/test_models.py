@@ -0,0 +1,212 @@
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+
+from geokey.users.models import User
+from geokey.users.tests.model_factories import UserFactory
+from geokey.projects.tests.model_factories import ProjectFactory
+from geokey.contributions.tests.model_factories import ObservationFactory
+from geokey.contributions.tests.media.model_factories import (
+    ImageFileFactory
+)
+
+from ..models import (
+    EpiCollectProject, EpiCollectMedia, EpiCollectMediaHash,
+    EpiCollectExportRow, project_cache, user_cache, get_enabled_project,
+    get_anonymous_user
+)
+
+
+# Cached projects are checked against the schema version, which is only
+# kept by a cache backend that stores it
+@override_settings(CACHES={'default': {
+    'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class EnabledProjectTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        project_cache.clear()
+        self.project = ProjectFactory.create()
+
+    def test_get_enabled_project(self):
+        EpiCollectProject.objects.create(project=self.project, enabled=True)
+
+        self.assertEqual(get_enabled_project(self.project.id), self.project)
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                get_enabled_project(str(self.project.id)), self.project)
+
+        self.assertEqual(project_cache.hits, 1)
+        self.assertEqual(project_cache.misses, 1)
+        self.assertEqual(project_cache.stats()['hit_rate'], 0.5)
+
+    def test_get_disabled_project(self):
+        EpiCollectProject.objects.create(project=self.project, enabled=False)
+        self.assertIsNone(get_enabled_project(self.project.id))
+
+    def test_get_project_not_enabled(self):
+        self.assertIsNone(get_enabled_project(self.project.id))
+
+        with self.assertNumQueries(0):
+            self.assertIsNone(get_enabled_project(self.project.id))
+
+    def test_cache_invalidated(self):
+        epicollect = EpiCollectProject.objects.create(
+            project=self.project, enabled=True)
+        self.assertEqual(get_enabled_project(self.project.id), self.project)
+
+        epicollect.enabled = False
+        epicollect.save()
+        self.assertIsNone(get_enabled_project(self.project.id))
+
+        epicollect.delete()
+        self.assertIsNone(get_enabled_project(self.project.id))
+
+
+class AnonymousUserTest(TestCase):
+    def setUp(self):
+        user_cache.clear()
+
+    def test_get_anonymous_user(self):
+        if not User.objects.filter(display_name='AnonymousUser').exists():
+            UserFactory.create(display_name='AnonymousUser')
+
+        user = get_anonymous_user()
+        self.assertEqual(user.display_name, 'AnonymousUser')
+
+        with self.assertNumQueries(0):
+            self.assertEqual(get_anonymous_user(), user)
+
+
+class EpiCollectMediaManagerTest(TestCase):
+    def test_get_pending(self):
+        project = ProjectFactory.create()
+        contribution = ObservationFactory.create(**{'project': project})
+        media = EpiCollectMedia.objects.create(
+            project=project,
+            contribution=contribution,
+            file_name='photo.jpg'
+        )
+
+        pending = EpiCollectMedia.objects.get_pending(project.id, 'photo.jpg')
+        self.assertEqual(pending, media)
+        self.assertEqual(pending.contribution, contribution)
+
+        self.assertIsNone(
+            EpiCollectMedia.objects.get_pending(project.id, 'video.mp4'))
+        self.assertIsNone(
+            EpiCollectMedia.objects.get_pending(project.id + 1, 'photo.jpg'))
+
+
+class EpiCollectMediaHashManagerTest(TestCase):
+    def test_get_stored(self):
+        image_file = ImageFileFactory.create()
+        EpiCollectMediaHash.objects.record('abc', 'image', image_file)
+        EpiCollectMediaHash.objects.record('abc', 'image', image_file)
+
+        stored = EpiCollectMediaHash.objects.get_stored('abc', 'image')
+        self.assertEqual(stored.stored_file.name, image_file.image.name)
+        self.assertIsNone(
+            EpiCollectMediaHash.objects.get_stored('abc', 'video'))
+        self.assertIsNone(
+            EpiCollectMediaHash.objects.get_stored(None, 'image'))
+
+    def test_get_stored_removed_file(self):
+        image_file = ImageFileFactory.create()
+        EpiCollectMediaHash.objects.record('abc', 'image', image_file)
+        image_file.image.storage.delete(image_file.image.name)
+
+        self.assertIsNone(
+            EpiCollectMediaHash.objects.get_stored('abc', 'image'))
+        self.assertFalse(EpiCollectMediaHash.objects.exists())
+
+
+class EpiCollectExportRowManagerTest(TestCase):
+    def setUp(self):
+        project_cache.clear()
+        self.project = ProjectFactory.create()
+
+    def test_observation_saved(self):
+        EpiCollectProject.objects.create(project=self.project, enabled=True)
+        observation = ObservationFactory.create(**{
+            'project': self.project,
+            'properties': {'key': 'value'}
+        })
+
+        row = EpiCollectExportRow.objects.get(observation=observation)
+        self.assertEqual(row.project, self.project)
+        self.assertIn('<id>%s</id>' % observation.id, row.xml)
+        self.assertTrue(row.tsv.startswith('\tid\t%s\t' % observation.id))
+
+        observation.properties = {'key': 'changed'}
+        observation.save()
+        self.assertIn(
+            'changed', EpiCollectExportRow.objects.get(pk=observation.id).xml)
+
+        observation.delete()
+        self.assertFalse(EpiCollectExportRow.objects.exists())
+
+    def test_project_not_enabled(self):
+        ObservationFactory.create(**{'project': self.project})
+        self.assertFalse(EpiCollectExportRow.objects.exists())
+
+    def test_project_disabled(self):
+        epicollect = EpiCollectProject.objects.create(
+            project=self.project, enabled=True)
+        ObservationFactory.create_batch(2, **{
+            'project': self.project,
+            'properties': {'key': 'value'}
+        })
+        self.assertEqual(EpiCollectExportRow.objects.count(), 2)
+
+        epicollect.enabled = False
+        epicollect.save()
+        self.assertFalse(EpiCollectExportRow.objects.exists())
+
+        epicollect.enabled = True
+        epicollect.save()
+        ObservationFactory.create(**{
+            'project': self.project,
+            'properties': {'key': 'value'}
+        })
+        self.assertEqual(EpiCollectExportRow.objects.count(), 1)
+
+        epicollect.delete()
+        self.assertFalse(EpiCollectExportRow.objects.exists())
+
+    def test_is_current_compares_rows(self):
+        EpiCollectProject.objects.create(project=self.project, enabled=True)
+        first = ObservationFactory.create_batch(2, **{
+            'project': self.project,
+            'properties': {'key': 'value'}
+        })[0]
+        self.assertTrue(
+            EpiCollectExportRow.objects.is_current(self.project.id, 2))
+
+        # The newest change is still stored, the first row is outdated
+        EpiCollectExportRow.objects.filter(pk=first.id).update(
+            updated_at=first.updated_at - timedelta(minutes=1))
+        self.assertFalse(
+            EpiCollectExportRow.objects.is_current(self.project.id, 2))
+
+    def test_rebuild(self):
+        ObservationFactory.create_batch(5, **{
+            'project': self.project,
+            'properties': {'key': 'value'}
+        })
+        count = self.project.observations.count()
+        self.assertFalse(
+            EpiCollectExportRow.objects.is_current(self.project.id, count))
+
+        self.assertEqual(
+            EpiCollectExportRow.objects.rebuild(self.project.id, 2), 5)
+        self.assertTrue(
+            EpiCollectExportRow.objects.is_current(self.project.id, count))
+        self.assertEqual(
+            list(EpiCollectExportRow.objects.get_fragments(
+                self.project.id, 'tsv')),
+            [
+                EpiCollectExportRow.objects.get(pk=observation.id).tsv
+                for observation in self.project.observations.all()
+            ]
+        )
@@ -0,0 +1,265 @@
+"""
+Regression guards for the form, download and upload paths. The number of
+queries must not grow with the size of a project, and exports must stream
+within a bounded amount of memory.
+"""
+import os
+import gc
+import resource
+
+from unittest import skipIf
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+from django.db import connection
+from django.core.urlresolvers import reverse
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from rest_framework.test import APIRequestFactory
+
+from geokey.users.models import User
+from geokey.users.tests.model_factories import UserFactory
+from geokey.projects.models import Project
+from geokey.projects.tests.model_factories import ProjectFactory
+from geokey.categories.tests.model_factories import (
+    CategoryFactory, TextFieldFactory, LookupFieldFactory, LookupValueFactory,
+    MultipleLookupFieldFactory, MultipleLookupValueFactory
+)
+from geokey.contributions.models import Observation
+from geokey.contributions.tests.model_factories import (
+    LocationFactory, ObservationFactory
+)
+
+from ..models import (
+    EpiCollectProject as EpiCollectProjectModel, EpiCollectExportRow,
+    project_cache, user_cache
+)
+from ..upload import schema_cache
+from ..serializer import ProjectFormSerializer, DataSerializer
+from ..views import EpiCollectUploadView, EpiCollectDownloadView
+
+
+# Upper bounds on the queries of each path, whatever the size of the project
+MAX_FORM_QUERIES = 6
+MAX_DOWNLOAD_QUERIES = 6
+MAX_UPLOAD_QUERIES = 25
+
+SIZES = [1, 5, 20]
+
+
+def get_rss():
+    """
+    Returns the resident set size of the process in bytes. Python 2 has no
+    `tracemalloc`, so memory is measured from `/proc` instead.
+    """
+    with open('/proc/self/statm') as statm:
+        return int(statm.read().split()[1]) * resource.getpagesize()
+
+
+def count_queries(func):
+    with CaptureQueriesContext(connection) as context:
+        func()
+
+    return len(context.captured_queries)
+
+
+# The caches the paths rely on only hit with a cache backend that stores
+# versions, not with `DummyCache`
+@override_settings(CACHES={'default': {
+    'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class QueryBoundsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        project_cache.clear()
+        user_cache.clear()
+        schema_cache.clear()
+
+        if not User.objects.filter(display_name='AnonymousUser').exists():
+            UserFactory.create(display_name='AnonymousUser')
+
+    def create_project(self, size):
+        """
+        Creates a project with `size` categories, each with `size` fields of
+        every kind, `size` values per lookup and `size` observations.
+        """
+        project = ProjectFactory.create(
+            **{'isprivate': False, 'everyone_contributes': True}
+        )
+        EpiCollectProjectModel.objects.create(project=project, enabled=True)
+
+        for index in range(size):
+            category = CategoryFactory.create(**{'project': project})
+            TextFieldFactory.create_batch(size, **{'category': category})
+
+            for lookup in LookupFieldFactory.create_batch(
+                    size, **{'category': category}):
+                LookupValueFactory.create_batch(size, **{'field': lookup})
+
+            for lookup in MultipleLookupFieldFactory.create_batch(
+                    size, **{'category': category}):
+                MultipleLookupValueFactory.create_batch(
+                    size, **{'field': lookup})
+
+            ObservationFactory.create_batch(size, **{
+                'project': project,
+                'category': category,
+                'properties': {'key': 'value'}
+            })
+
+        return Project.objects.get(pk=project.id)
+
+    def assertBounded(self, counts, maximum):
+        self.assertEqual(
+            len(set(counts.values())), 1,
+            'Queries grow with the size of the project: %s' % counts
+        )
+        self.assertLessEqual(max(counts.values()), maximum)
+
+    def test_form_queries(self):
+        serializer = ProjectFormSerializer()
+        counts = {}
+
+        for size in SIZES:
+            project = self.create_project(size)
+            counts[size] = count_queries(
+                lambda: serializer.serialize(project, 'localhost'))
+
+        self.assertBounded(counts, MAX_FORM_QUERIES)
+
+    def test_download_queries(self):
+        factory = APIRequestFactory()
+        view = EpiCollectDownloadView.as_view()
+
+        # Observations are serialised if the export snapshot is outdated
+        for xml, snapshot in [('true', True), ('false', True),
+                              ('true', False), ('false', False)]:
+            counts = {}
+
+            for size in SIZES:
+                project = self.create_project(size)
+                url = reverse('geokey_epicollect:download', kwargs={
+                    'project_id': project.id
+                })
+
+                if not snapshot:
+                    EpiCollectExportRow.objects.filter(
+                        project=project).delete()
+
+                def download():
+                    request = factory.get(url + '?xml=' + xml)
+                    response = view(request, project_id=project.id)
+                    b''.join(response.streaming_content)
+
+                counts[size] = count_queries(download)
+
+            self.assertBounded(counts, MAX_DOWNLOAD_QUERIES)
+
+    def test_upload_queries(self):
+        factory = APIRequestFactory()
+        view = EpiCollectUploadView.as_view()
+        counts = {}
+
+        for size in SIZES:
+            project = self.create_project(size)
+            category = project.categories.first()
+            url = reverse('geokey_epicollect:upload', kwargs={
+                'project_id': project.id
+            })
+            data = (
+                'location_lat=51.5175205&location_lon=-0.1729205&'
+                'category=%s' % category.id
+            )
+
+            def upload():
+                request = factory.post(
+                    url + '?type=data',
+                    data,
+                    content_type='application/x-www-form-urlencoded'
+                )
+                response = view(request, project_id=project.id)
+                self.assertEqual(response.content, '1')
+
+            # The first upload loads the caches
+            upload()
+            counts[size] = count_queries(upload)
+
+        self.assertBounded(counts, MAX_UPLOAD_QUERIES)
+
+
+@skipIf(
+    tracemalloc is None and not os.path.exists('/proc/self/statm'),
+    'Neither tracemalloc nor /proc is available'
+)
+class ExportMemoryTest(TestCase):
+    observations = 50000
+    # Streamed exports hold one chunk and one batch of rows at a time
+    max_peak_memory = 32 * 2 ** 20
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.project = ProjectFactory.create(**{'isprivate': False})
+        category = CategoryFactory.create(**{'project': cls.project})
+        location = LocationFactory.create()
+
+        Observation.objects.bulk_create([
+            Observation(
+                project=cls.project,
+                category=category,
+                location=location,
+                creator=cls.project.creator,
+                status='active',
+                properties={'key': 'value', 'unique_id': str(index)}
+            )
+            for index in range(cls.observations)
+        ], batch_size=5000)
+
+    def get_peak_memory(self, chunks):
+        """
+        Drains the chunks and returns the peak memory allocated meanwhile
+        and the size of the largest chunk. Without `tracemalloc`, the growth
+        of the resident set size is sampled after each chunk.
+        """
+        largest = 0
+
+        if tracemalloc is not None:
+            tracemalloc.start()
+            try:
+                for chunk in chunks:
+                    largest = max(largest, len(chunk))
+
+                return tracemalloc.get_traced_memory()[1], largest
+            finally:
+                tracemalloc.stop()
+
+        gc.collect()
+        before = get_rss()
+        peak = 0
+
+        for chunk in chunks:
+            largest = max(largest, len(chunk))
+            peak = max(peak, get_rss() - before)
+
+        return peak, largest
+
+    def test_stream_xml(self):
+        serializer = DataSerializer()
+        peak, largest = self.get_peak_memory(
+            serializer.stream_xml(self.project))
+
+        self.assertLess(peak, self.max_peak_memory)
+        # A chunk holds at most one entry more than the chunk size
+        self.assertLess(largest, 2 * serializer.chunk_size)
+
+    def test_stream_tsv(self):
+        serializer = DataSerializer()
+        peak, largest = self.get_peak_memory(
+            serializer.stream_tsv(self.project))
+
+        self.assertLess(peak, self.max_peak_memory)
+        # One line per chunk
+        self.assertLess(largest, serializer.chunk_size)
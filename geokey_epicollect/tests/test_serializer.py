@@ -1,5 +1,9 @@
 import calendar
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from lxml import etree
 
 from ..serializer import ProjectFormSerializer, DataSerializer
 from geokey.categories.tests.model_factories import (
@@ -8,6 +12,7 @@ from geokey.categories.tests.model_factories import (
     MultipleLookupFieldFactory, MultipleLookupValueFactory
 )
 
+from geokey.projects.models import Project
 from geokey.projects.tests.model_factories import ProjectFactory
 from geokey.categories.tests.model_factories import CategoryFactory
 from geokey.contributions.tests.model_factories import ObservationFactory
@@ -326,6 +331,51 @@ class ProjectFormSerializerTest(TestCase):
             'Location'
         )
 
+    def test_serialize_project_queries_do_not_grow_with_fields(self):
+        serializer = ProjectFormSerializer()
+        queries = []
+
+        for number in [1, 3, 6]:
+            project = ProjectFactory()
+            for category in CategoryFactory.create_batch(
+                    number, **{'project': project}):
+                TextFieldFactory.create_batch(
+                    number, **{'category': category})
+                NumericFieldFactory(**{'category': category})
+                lookup = LookupFieldFactory(**{'category': category})
+                LookupValueFactory.create_batch(
+                    number, **{'field': lookup})
+                multiple = MultipleLookupFieldFactory(
+                    **{'category': category})
+                MultipleLookupValueFactory.create_batch(
+                    number, **{'field': multiple})
+
+            with CaptureQueriesContext(connection) as context:
+                xml = serializer.serialize(project, 'localhost')
+
+            queries.append(len(context.captured_queries))
+            self.assertEqual(
+                len(xml.find('form').findall('radio')), number)
+            self.assertEqual(
+                len(xml.find('form').find('radio').findall('item')), number)
+
+        self.assertEqual(len(set(queries)), 1)
+
+    def test_serialize_categories_jumps_over_inactive_fields(self):
+        project = ProjectFactory()
+        category = CategoryFactory.create(**{'project': project})
+        active = TextFieldFactory(**{'category': category})
+        TextFieldFactory(**{'category': category, 'status': 'inactive'})
+
+        serializer = ProjectFormSerializer()
+        form = serializer.serialize_categories(
+            serializer.get_categories(project))
+
+        field = form.find('input')
+        self.assertEqual(
+            field.attrib['ref'], '%s_%s' % (active.key, category.id))
+        self.assertEqual(field.attrib['jump'], 'photo,ALL')
+
 
 class SerializeDataTest(TestCase):
     def test_serialize_observation(self):
@@ -375,6 +425,29 @@ class SerializeDataTest(TestCase):
         tsv = serializer.serialize_entry_to_tsv(observation)
         self.assertIn('thekey_%s\tNull' % observation.category.id, tsv)
 
+    def test_get_rows(self):
+        project = ProjectFactory.create(**{'isprivate': False})
+        ObservationFactory.create_batch(
+            5, **{'project': project, 'properties': {'key': 'value'}}
+        )
+
+        serializer = DataSerializer()
+        observations = serializer.get_observations(project)
+
+        self.assertEqual(
+            list(serializer.get_rows(observations)),
+            [serializer.get_row(observation) for observation in observations]
+        )
+
+    def test_get_tag_names(self):
+        serializer = DataSerializer()
+        tag_names = serializer.get_tag_names(7)
+
+        self.assertEqual(tag_names['the-key'], 'the_key_7')
+        self.assertEqual(tag_names['unique_id'], 'unique_id')
+        self.assertIs(serializer.get_tag_names(7), tag_names)
+        self.assertEqual(serializer.get_tag_names(8)['the-key'], 'the_key_8')
+
     def test_serialize_all_to_xml(self):
         number = 20
         project = ProjectFactory.create(**{'isprivate': False})
@@ -387,6 +460,37 @@ class SerializeDataTest(TestCase):
 
         self.assertEqual(len(xml.findall('entry')), number)
 
+    def test_stream_xml(self):
+        number = 20
+        project = ProjectFactory.create(**{'isprivate': False})
+        ObservationFactory.create_batch(
+            number, **{'project': project, 'properties': {'key': 'value'}}
+        )
+
+        serializer = DataSerializer()
+        chunks = list(serializer.stream_xml(project))
+
+        self.assertTrue(chunks[0].startswith('<entries><table>'))
+        self.assertNotIn('<entry>', chunks[0])
+        self.assertEqual(
+            ''.join(chunks),
+            etree.tostring(serializer.serialize_to_xml(project))
+        )
+
+    def test_stream_xml_in_chunks(self):
+        project = ProjectFactory.create(**{'isprivate': False})
+        ObservationFactory.create_batch(
+            20, **{'project': project, 'properties': {'key': 'value'}}
+        )
+
+        serializer = DataSerializer()
+        serializer.chunk_size = 1
+        chunks = list(serializer.stream_xml(project))
+
+        self.assertEqual(
+            len(etree.fromstring(''.join(chunks)).findall('entry')), 20)
+        self.assertTrue(len(chunks) > 20)
+
     def test_serialize_all_to_tsv(self):
         number = 20
         project = ProjectFactory.create(**{'isprivate': False})
@@ -397,3 +501,57 @@ class SerializeDataTest(TestCase):
         serializer = DataSerializer()
         tsv = serializer.serialize_to_tsv(project)
         self.assertEqual(20, tsv.count('\n'))
+
+    def test_stream_tsv(self):
+        number = 20
+        project = ProjectFactory.create(**{'isprivate': False})
+        ObservationFactory.create_batch(
+            number, **{'project': project, 'properties': {'key': 'value'}}
+        )
+
+        serializer = DataSerializer()
+        lines = list(serializer.stream_tsv(project))
+
+        self.assertEqual(len(lines), number)
+        self.assertEqual(
+            ''.join(lines),
+            serializer.serialize_to_tsv(project).encode('utf-8')
+        )
+
+    def test_serialize_entry_to_tsv_format(self):
+        observation = ObservationFactory.create()
+        observation.properties = {'thekey': 'value'}
+
+        serializer = DataSerializer()
+        tsv = serializer.serialize_entry_to_tsv(observation)
+
+        self.assertTrue(tsv.startswith(
+            observation.project.name.replace(' ', '_') + '\tid\t' +
+            str(observation.id) + '\t'
+        ))
+        self.assertTrue(tsv.endswith(
+            'thekey_%s\tvalue\t\n' % observation.category.id))
+
+    def test_serialize_queries_do_not_grow_with_observations(self):
+        serializer = DataSerializer()
+        queries = {}
+
+        for number in [1, 10, 25]:
+            project = ProjectFactory.create(**{'isprivate': False})
+            ObservationFactory.create_batch(
+                number, **{'project': project, 'properties': {'key': 'v'}}
+            )
+            project = Project.objects.get(pk=project.id)
+
+            with CaptureQueriesContext(connection) as xml_context:
+                list(serializer.stream_xml(project))
+            with CaptureQueriesContext(connection) as tsv_context:
+                list(serializer.stream_tsv(project))
+
+            queries[number] = (
+                len(xml_context.captured_queries),
+                len(tsv_context.captured_queries)
+            )
+
+        self.assertEqual(queries[1], queries[10])
+        self.assertEqual(queries[1], queries[25])
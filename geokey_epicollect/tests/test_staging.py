@@ -0,0 +1,124 @@
+from datetime import timedelta
+
+from django.test import TestCase
+from django.utils import timezone
+
+from geokey.users.models import User
+from geokey.users.tests.model_factories import UserFactory
+from geokey.projects.tests.model_factories import ProjectFactory
+from geokey.categories.tests.model_factories import (
+    CategoryFactory, TextFieldFactory
+)
+
+from ..models import (
+    EpiCollectMedia, EpiCollectStagedEntry, EpiCollectSubmission, user_cache
+)
+from .. import staging
+from ..staging import (
+    MAX_ATTEMPTS, stage_entry, get_retry_delay, process_staged_entries
+)
+
+
+class ProcessStagedEntriesTest(TestCase):
+    def setUp(self):
+        user_cache.clear()
+        if not User.objects.filter(display_name='AnonymousUser').exists():
+            UserFactory.create(display_name='AnonymousUser')
+
+        self.project = ProjectFactory.create(
+            **{'isprivate': False, 'everyone_contributes': True}
+        )
+        self.category = CategoryFactory.create(**{'project': self.project})
+        self.field = TextFieldFactory(**{'category': self.category})
+
+    def get_entry(self, unique_id, **kwargs):
+        entry = {
+            'location_lat': '51.5175205',
+            'location_lon': '-0.1729205',
+            'category': str(self.category.id),
+            'unique_id': unique_id,
+            '%s_%s' % (self.field.key, self.category.id): 'Westbourne Park'
+        }
+        entry.update(kwargs)
+        return entry
+
+    def test_process(self):
+        stage_entry(self.project, self.get_entry('1', photo='a.jpg'), 'abc')
+        stage_entry(self.project, self.get_entry('1', photo='a.jpg'), 'abc')
+        stage_entry(self.project, self.get_entry('2'), 'abc')
+
+        self.assertEqual(process_staged_entries(batch_size=10), 3)
+        self.assertEqual(process_staged_entries(batch_size=10), 0)
+
+        self.assertEqual(EpiCollectStagedEntry.objects.count(), 0)
+        self.assertEqual(self.project.observations.count(), 2)
+        self.assertEqual(EpiCollectMedia.objects.count(), 1)
+        self.assertEqual(
+            EpiCollectSubmission.objects.filter(project=self.project).count(),
+            2
+        )
+        self.assertEqual(
+            [observation.properties['DeviceID']
+             for observation in self.project.observations.all()],
+            ['abc', 'abc']
+        )
+
+    def test_process_in_batches(self):
+        for unique_id in range(3):
+            stage_entry(self.project, self.get_entry(str(unique_id)), None)
+
+        self.assertEqual(process_staged_entries(batch_size=2), 2)
+        self.assertEqual(process_staged_entries(batch_size=2), 1)
+        self.assertEqual(self.project.observations.count(), 3)
+
+    def test_retry_failed_entry(self):
+        entry = stage_entry(
+            self.project, self.get_entry('1', category='999999'), None)
+
+        process_staged_entries()
+        entry.refresh_from_db()
+
+        self.assertEqual(entry.status, 'pending')
+        self.assertEqual(entry.attempts, 1)
+        self.assertIn('DoesNotExist', entry.last_error)
+        self.assertGreater(entry.next_attempt_at, timezone.now())
+
+        # Not due yet
+        self.assertEqual(process_staged_entries(), 0)
+
+        for attempt in range(MAX_ATTEMPTS - 1):
+            EpiCollectStagedEntry.objects.filter(pk=entry.pk).update(
+                next_attempt_at=timezone.now())
+            process_staged_entries()
+
+        entry.refresh_from_db()
+        self.assertEqual(entry.status, 'failed')
+        self.assertEqual(entry.attempts, MAX_ATTEMPTS)
+        self.assertEqual(self.project.observations.count(), 0)
+
+    def test_unexpected_error(self):
+        get_contribution_serializer = staging.get_contribution_serializer
+
+        def failing(project, user, data, device_id):
+            if data.get('unique_id') == '1':
+                raise RuntimeError('Unexpected')
+            return get_contribution_serializer(project, user, data, device_id)
+
+        entry = stage_entry(self.project, self.get_entry('1'), None)
+        stage_entry(self.project, self.get_entry('2'), None)
+
+        staging.get_contribution_serializer = failing
+        try:
+            self.assertEqual(process_staged_entries(), 2)
+        finally:
+            staging.get_contribution_serializer = get_contribution_serializer
+
+        entry.refresh_from_db()
+        self.assertEqual(entry.attempts, 1)
+        self.assertIn('RuntimeError', entry.last_error)
+        self.assertEqual(EpiCollectStagedEntry.objects.count(), 1)
+        self.assertEqual(self.project.observations.count(), 1)
+
+    def test_get_retry_delay(self):
+        self.assertEqual(get_retry_delay(2), 2 * get_retry_delay(1))
+        self.assertEqual(get_retry_delay(100), timedelta(days=1))
@@ -0,0 +1,85 @@
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+
+from geokey.projects.tests.model_factories import ProjectFactory
+from geokey.categories.models import Category
+from geokey.categories.tests.model_factories import (
+    CategoryFactory, TextFieldFactory, DateFieldFactory,
+    MultipleLookupFieldFactory
+)
+
+from ..upload import (
+    schema_cache, get_category_schema, build_contribution
+)
+
+
+@override_settings(CACHES={'default': {
+    'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class CategorySchemaTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        schema_cache.clear()
+        self.project = ProjectFactory.create()
+        self.category = CategoryFactory.create(**{'project': self.project})
+
+    def test_convert(self):
+        text = TextFieldFactory(**{'category': self.category})
+        date = DateFieldFactory(**{'category': self.category})
+        checkboxes = MultipleLookupFieldFactory(**{'category': self.category})
+
+        schema = get_category_schema(str(self.category.id))
+        properties = schema.convert({
+            '%s_%s' % (text.key, self.category.id): 'Westbourne Park',
+            '%s_%s' % (date.key, self.category.id): '24/12/2015',
+            '%s_%s' % (checkboxes.key, self.category.id): '1, 2'
+        })
+
+        self.assertEqual(properties[text.key], 'Westbourne Park')
+        self.assertEqual(properties[date.key], '2015-12-24')
+        self.assertEqual(properties[checkboxes.key], [1, 2])
+
+    def test_cached_schema(self):
+        TextFieldFactory(**{'category': self.category})
+        schema = get_category_schema(self.category.id)
+
+        with self.assertNumQueries(0):
+            self.assertIs(get_category_schema(self.category.id), schema)
+
+    def test_schema_invalidated(self):
+        TextFieldFactory(**{'category': self.category})
+        schema = get_category_schema(self.category.id)
+        field = TextFieldFactory(**{'category': self.category})
+
+        updated = get_category_schema(self.category.id)
+        self.assertIsNot(updated, schema)
+        self.assertIn(field.key, [key for key, _, _ in updated.fields])
+
+    def test_invalid_category(self):
+        with self.assertRaises(ValueError):
+            get_category_schema('Null')
+        with self.assertRaises(TypeError):
+            get_category_schema(None)
+        with self.assertRaises(Category.DoesNotExist):
+            get_category_schema(218421894)
+
+    def test_build_contribution(self):
+        field = TextFieldFactory(**{'category': self.category})
+        schema = get_category_schema(self.category.id)
+
+        contribution = build_contribution(schema, {
+            'location_lat': '51.5175205',
+            'location_lon': '-0.1729205',
+            'category': str(self.category.id),
+            'unique_id': 'abc',
+            '%s_%s' % (field.key, self.category.id): 'Westbourne Park'
+        }, 'phone')
+
+        self.assertEqual(
+            contribution['properties'][field.key], 'Westbourne Park')
+        self.assertEqual(contribution['properties']['DeviceID'], 'phone')
+        self.assertEqual(contribution['properties']['unique_id'], 'abc')
+        self.assertEqual(
+            contribution['meta']['category'], str(self.category.id))
+
+        with self.assertRaises(TypeError):
+            build_contribution(schema, {}, 'phone')
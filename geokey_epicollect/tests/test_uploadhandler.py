@@ -0,0 +1,28 @@
+import os
+import hashlib
+
+from django.test import TestCase, RequestFactory
+
+from ..uploadhandler import HashingFileUploadHandler
+
+
+class HashingFileUploadHandlerTest(TestCase):
+    def test_upload(self):
+        content = os.urandom(3 * HashingFileUploadHandler.chunk_size + 1)
+
+        handler = HashingFileUploadHandler(RequestFactory().post('/'))
+        handler.new_file('name', 'video.mp4', 'video/mp4', len(content))
+
+        for start in range(0, len(content), handler.chunk_size):
+            handler.receive_data_chunk(
+                content[start:start + handler.chunk_size], start)
+
+        uploaded_file = handler.file_complete(len(content))
+
+        self.assertEqual(
+            uploaded_file.sha256, hashlib.sha256(content).hexdigest())
+        self.assertEqual(uploaded_file.size, len(content))
+        with open(uploaded_file.temporary_file_path(), 'rb') as f:
+            self.assertEqual(f.read(), content)
+
+        uploaded_file.close()
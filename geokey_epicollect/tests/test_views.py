@@ -1,4 +1,13 @@
-from django.test import TestCase
+import json
+
+from datetime import timedelta
+
+from django.db import connection
+from django.core.exceptions import ImproperlyConfigured
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 from django.core.urlresolvers import reverse
 from django.http import HttpRequest, QueryDict
 from django.contrib.auth.models import AnonymousUser
@@ -7,12 +16,15 @@ from django.contrib.sites.shortcuts import get_current_site
 
 from rest_framework.test import APITestCase, APIRequestFactory
 
+from lxml import etree
+
 from geokey import version
 from geokey.core.tests.helpers import render_helpers
 from geokey.users.models import User
 from geokey.users.tests.model_factories import UserFactory
 from geokey.projects.models import Project
 from geokey.projects.tests.model_factories import ProjectFactory
+from geokey.contributions.models import ImageFile
 from geokey.contributions.tests.model_factories import ObservationFactory
 from geokey.contributions.tests.media.model_factories import get_image
 from geokey.categories.tests.model_factories import (
@@ -20,10 +32,15 @@ from geokey.categories.tests.model_factories import (
     MultipleLookupValueFactory
 )
 from ..models import (
-    EpiCollectMedia, EpiCollectProject as EpiCollectProjectModel
+    EpiCollectMedia, EpiCollectProject as EpiCollectProjectModel,
+    EpiCollectSubmission, EpiCollectStagedEntry, EpiCollectMediaHash,
+    EpiCollectExportRow, user_cache
 )
+from ..serializer import DataSerializer
+from ..cache import get_version_key, get_data_version, get_version_timestamp
 from ..views import (
-    IndexPage, EpiCollectProject, EpiCollectUploadView, EpiCollectDownloadView
+    CURSOR_OVERLAP, IndexPage, EpiCollectProject, EpiCollectUploadView,
+    EpiCollectBatchUploadView, EpiCollectDownloadView
 )
 
 
@@ -116,6 +133,63 @@ class IndexPageTest(TestCase):
         response = render_helpers.remove_csrf(response.content.decode('utf-8'))
         self.assertEqual(response, rendered)
 
+    def test_post_with_disabled_project(self):
+        user = UserFactory.create()
+        project = ProjectFactory.create(
+            **{'isprivate': False, 'creator': user})
+        EpiCollectProjectModel.objects.create(project=project, enabled=False)
+
+        self.request.user = user
+        response = self.view(self.request)
+        self.assertEqual(response.context_data['epicollect'], [])
+        self.assertNotIn(
+            'value="%s" checked' % project.id, response.render().content)
+
+        self.request.method = 'POST'
+        self.request.POST = QueryDict('epicollect_project=%s' % project.id)
+        response = self.view(self.request).render()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(
+            EpiCollectProjectModel.objects.get(project=project).enabled)
+        self.assertEqual(
+            [epi.project_id for epi in response.context_data['epicollect']],
+            [project.id]
+        )
+
+    def test_post_queries(self):
+        user = UserFactory.create()
+        self.request.method = 'POST'
+        self.request.user = user
+        counts = []
+
+        for size in [2, 10]:
+            projects = ProjectFactory.create_batch(
+                size * 2, **{'isprivate': False, 'creator': user})
+            EpiCollectProjectModel.objects.bulk_create([
+                EpiCollectProjectModel(project=project, enabled=True)
+                for project in projects[:size]
+            ])
+            self.request.POST = QueryDict('', mutable=True)
+            self.request.POST.setlist(
+                'epicollect_project',
+                [str(project.id) for project in projects[size:]]
+            )
+
+            with CaptureQueriesContext(connection) as context:
+                self.view(self.request).render()
+            counts.append(len(context.captured_queries))
+
+            enabled = EpiCollectProjectModel.objects.filter(
+                project__in=projects).values_list('project_id', flat=True)
+            self.assertEqual(
+                set(enabled),
+                set(project.id for project in projects[size:])
+            )
+            EpiCollectProjectModel.objects.all().delete()
+
+        self.assertEqual(counts[0], counts[1])
+
 
 class ProjectDescriptionViewTest(APITestCase):
     def test_get_project(self):
@@ -135,6 +209,84 @@ class ProjectDescriptionViewTest(APITestCase):
         response = view(request, project_id=project.id)
         self.assertEqual(response.status_code, 200)
 
+    @override_settings(CACHES={'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_get_project_from_cache(self):
+        cache.clear()
+        project = ProjectFactory.create(**{'isprivate': False})
+        EpiCollectProjectModel.objects.create(project=project, enabled=True)
+        category = CategoryFactory.create(**{'project': project})
+        TextFieldFactory(**{'category': category})
+        factory = APIRequestFactory()
+        url = reverse('geokey_epicollect:project_form', args=(project.id, ))
+        view = EpiCollectProject.as_view()
+
+        response = view(factory.get(url), project_id=project.id)
+        self.assertEqual(response.status_code, 200)
+
+        with self.assertNumQueries(0):
+            cached = view(factory.get(url), project_id=project.id)
+        self.assertEqual(cached.content, response.content)
+
+        field = TextFieldFactory(**{'category': category})
+        response = view(factory.get(url), project_id=project.id)
+        self.assertIn(field.key, response.content)
+
+    @override_settings(CACHES={'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_get_project_renamed_elsewhere(self):
+        cache.clear()
+        project = ProjectFactory.create(**{'isprivate': False})
+        EpiCollectProjectModel.objects.create(project=project, enabled=True)
+        CategoryFactory.create(**{'project': project})
+        factory = APIRequestFactory()
+        url = reverse('geokey_epicollect:project_form', args=(project.id, ))
+        view = EpiCollectProject.as_view()
+
+        response = view(factory.get(url), project_id=project.id)
+        self.assertEqual(response.status_code, 200)
+
+        # Another process renames the project, which replaces the version in
+        # the shared cache but not the project cached in this process
+        Project.objects.filter(pk=project.id).update(name='Renamed Project')
+        cache.delete(get_version_key('schema', project.id))
+
+        response = view(factory.get(url), project_id=project.id)
+        self.assertIn('projectName="renamed_project"', response.content)
+
+    @override_settings(CACHES={'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_get_project_not_modified(self):
+        cache.clear()
+        project = ProjectFactory.create(**{'isprivate': False})
+        EpiCollectProjectModel.objects.create(project=project, enabled=True)
+        category = CategoryFactory.create(**{'project': project})
+        TextFieldFactory(**{'category': category})
+        factory = APIRequestFactory()
+        url = reverse('geokey_epicollect:project_form', args=(project.id, ))
+        view = EpiCollectProject.as_view()
+
+        response = view(factory.get(url), project_id=project.id)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+
+        response = view(
+            factory.get(url, HTTP_IF_NONE_MATCH=etag), project_id=project.id)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+        response = view(
+            factory.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']),
+            project_id=project.id
+        )
+        self.assertEqual(response.status_code, 304)
+
+        TextFieldFactory(**{'category': category})
+        response = view(
+            factory.get(url, HTTP_IF_NONE_MATCH=etag), project_id=project.id)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
     def test_get_not_existing_project(self):
         factory = APIRequestFactory()
         request = factory.get(
@@ -151,6 +303,7 @@ class ProjectDescriptionViewTest(APITestCase):
 
 class UploadDataTest(APITestCase):
     def setUp(self):
+        user_cache.clear()
         if not User.objects.filter(display_name='AnonymousUser').exists():
             UserFactory.create(display_name='AnonymousUser')
 
@@ -184,6 +337,113 @@ class UploadDataTest(APITestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.content, '1')
 
+    def test_upload_data_to_disabled_project(self):
+        project = ProjectFactory.create(
+            **{'isprivate': False, 'everyone_contributes': True}
+        )
+        EpiCollectProjectModel.objects.create(project=project, enabled=False)
+        type1 = CategoryFactory.create(**{'project': project})
+        field = TextFieldFactory(**{'category': type1})
+
+        data = ('location_lat=51.5175205&location_lon=-0.1729205&location_acc='
+                '20&location_alt=&location_bearing=&category={category}&'
+                '{field_key}_{category}=Westbourne+Park'.format(
+                    category=type1.id,
+                    field_key=field.key)
+                )
+
+        factory = APIRequestFactory()
+        url = reverse('geokey_epicollect:upload', kwargs={
+            'project_id': project.id
+        })
+        request = factory.post(
+            url + '?type=data',
+            data,
+            content_type='application/x-www-form-urlencoded'
+        )
+
+        view = EpiCollectUploadView.as_view()
+        response = view(request, project_id=project.id)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, '0')
+
+    def test_upload_data_twice(self):
+        project = ProjectFactory.create(
+            **{'isprivate': False, 'everyone_contributes': True}
+        )
+        EpiCollectProjectModel.objects.create(project=project, enabled=True)
+        type1 = CategoryFactory.create(**{'project': project})
+        field = TextFieldFactory(**{'category': type1})
+
+        data = ('location_lat=51.5175205&location_lon=-0.1729205&location_acc='
+                '20&location_alt=&location_bearing=&category={category}&'
+                '{field_key}_{category}=Westbourne+Park&unique_id=abc&'
+                'photo=abc'.format(
+                    category=type1.id,
+                    field_key=field.key)
+                )
+
+        factory = APIRequestFactory()
+        url = reverse('geokey_epicollect:upload', kwargs={
+            'project_id': project.id
+        })
+        view = EpiCollectUploadView.as_view()
+
+        for i in range(2):
+            request = factory.post(
+                url + '?type=data',
+                data,
+                content_type='application/x-www-form-urlencoded'
+            )
+            response = view(request, project_id=project.id)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.content, '1')
+
+        self.assertEqual(project.observations.count(), 1)
+        self.assertEqual(EpiCollectMedia.objects.count(), 1)
+        self.assertEqual(
+            EpiCollectSubmission.objects.get(
+                project=project, unique_id='abc').contribution,
+            project.observations.get()
+        )
+
+    @override_settings(EPICOLLECT_ASYNC_UPLOADS=True)
+    def test_upload_data_async(self):
+        project = ProjectFactory.create(
+            **{'isprivate': False, 'everyone_contributes': True}
+        )
+        EpiCollectProjectModel.objects.create(project=project, enabled=True)
+        type1 = CategoryFactory.create(**{'project': project})
+        field = TextFieldFactory(**{'category': type1})
+
+        data = ('location_lat=51.5175205&location_lon=-0.1729205&location_acc='
+                '20&location_alt=&location_bearing=&category={category}&'
+                '{field_key}_{category}=Westbourne+Park'.format(
+                    category=type1.id,
+                    field_key=field.key)
+                )
+
+        factory = APIRequestFactory()
+        url = reverse('geokey_epicollect:upload', kwargs={
+            'project_id': project.id
+        })
+        request = factory.post(
+            url + '?type=data&phoneid=abc',
+            data,
+            content_type='application/x-www-form-urlencoded'
+        )
+
+        view = EpiCollectUploadView.as_view()
+        response = view(request, project_id=project.id)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, '1')
+        self.assertEqual(project.observations.count(), 0)
+
+        entry = EpiCollectStagedEntry.objects.get(project=project)
+        self.assertEqual(entry.device_id, 'abc')
+        self.assertEqual(
+            json.loads(entry.payload)['category'], str(type1.id))
+
     def test_upload_data_with_media(self):
         project = ProjectFactory.create(
             **{'isprivate': False, 'everyone_contributes': True}
@@ -360,6 +620,7 @@ class UploadDataTest(APITestCase):
         EpiCollectProjectModel.objects.create(project=project, enabled=True)
         contribution = ObservationFactory.create(**{'project': project})
         EpiCollectMedia.objects.create(
+            project=project,
             contribution=contribution,
             file_name=image.name
         )
@@ -376,12 +637,46 @@ class UploadDataTest(APITestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.content, '1')
 
+    def test_upload_same_image_twice(self):
+        image = get_image()
+        project = ProjectFactory.create()
+        EpiCollectProjectModel.objects.create(project=project, enabled=True)
+        contribution = ObservationFactory.create(**{'project': project})
+        for i in range(2):
+            EpiCollectMedia.objects.create(
+                project=project,
+                contribution=contribution,
+                file_name=image.name
+            )
+
+        factory = APIRequestFactory()
+        url = reverse('geokey_epicollect:upload', kwargs={
+            'project_id': project.id
+        })
+        view = EpiCollectUploadView.as_view()
+
+        for upload_type in ['thumbnail', 'full_image']:
+            image.seek(0)
+            request = factory.post(
+                url + '?type=' + upload_type, {'name': image})
+            response = view(request, project_id=project.id)
+            self.assertEqual(response.content, '1')
+
+        first, second = ImageFile.objects.filter(
+            contribution=contribution).order_by('id')
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertEqual(
+            EpiCollectMediaHash.objects.get(kind='image').media_file_id,
+            first.id
+        )
+
     def test_upload_image_with_fullimage_flag(self):
         image = get_image()
         project = ProjectFactory.create()
         EpiCollectProjectModel.objects.create(project=project, enabled=True)
         contribution = ObservationFactory.create(**{'project': project})
         EpiCollectMedia.objects.create(
+            project=project,
             contribution=contribution,
             file_name=image.name
         )
@@ -398,12 +693,38 @@ class UploadDataTest(APITestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.content, '1')
 
+    def test_upload_image_to_other_project(self):
+        image = get_image()
+        project = ProjectFactory.create()
+        other = ProjectFactory.create()
+        EpiCollectProjectModel.objects.create(project=project, enabled=True)
+        contribution = ObservationFactory.create(**{'project': other})
+        EpiCollectMedia.objects.create(
+            project=other,
+            contribution=contribution,
+            file_name=image.name
+        )
+
+        data = {'name': image}
+        factory = APIRequestFactory()
+        url = reverse('geokey_epicollect:upload', kwargs={
+            'project_id': project.id
+        })
+        request = factory.post(url + '?type=thumbnail', data)
+
+        view = EpiCollectUploadView.as_view()
+        response = view(request, project_id=project.id)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, '0')
+        self.assertEqual(EpiCollectMedia.objects.count(), 1)
+
     def test_upload_image_with_wrong_file_name(self):
         image = get_image()
         project = ProjectFactory.create()
         EpiCollectProjectModel.objects.create(project=project, enabled=True)
         contribution = ObservationFactory.create(**{'project': project})
         EpiCollectMedia.objects.create(
+            project=project,
             contribution=contribution,
             file_name='file_name.jpg'
         )
@@ -421,6 +742,183 @@ class UploadDataTest(APITestCase):
         self.assertEqual(response.content, '0')
 
 
+class ThumbnailPolicyTest(APITestCase):
+    def setUp(self):
+        user_cache.clear()
+        if not User.objects.filter(display_name='AnonymousUser').exists():
+            UserFactory.create(display_name='AnonymousUser')
+
+        self.project = ProjectFactory.create()
+        EpiCollectProjectModel.objects.create(
+            project=self.project, enabled=True)
+        self.contribution = ObservationFactory.create(
+            **{'project': self.project})
+        self.thumbnail = get_image()
+        self.image = get_image()
+        self.pending = EpiCollectMedia.objects.create(
+            project=self.project,
+            contribution=self.contribution,
+            file_name=self.image.name
+        )
+
+    def post(self, upload_type, image):
+        factory = APIRequestFactory()
+        url = reverse('geokey_epicollect:upload', kwargs={
+            'project_id': self.project.id
+        })
+        request = factory.post(url + '?type=' + upload_type, {'name': image})
+
+        view = EpiCollectUploadView.as_view()
+        response = view(request, project_id=self.project.id)
+        self.assertEqual(response.content, '1')
+
+    def get_image_files(self):
+        return ImageFile.objects.filter(contribution=self.contribution)
+
+    @override_settings(EPICOLLECT_THUMBNAIL_POLICY='drop')
+    def test_drop(self):
+        self.post('thumbnail', self.thumbnail)
+        self.assertEqual(self.get_image_files().count(), 0)
+
+        self.post('full_image', self.image)
+        self.assertEqual(self.get_image_files().count(), 1)
+        self.assertFalse(EpiCollectMedia.objects.exists())
+
+    @override_settings(EPICOLLECT_THUMBNAIL_POLICY='preview')
+    def test_preview(self):
+        self.post('thumbnail', self.thumbnail)
+        self.assertEqual(self.get_image_files().count(), 0)
+
+        preview = EpiCollectMedia.objects.get(pk=self.pending.pk).preview
+        self.assertTrue(preview.storage.exists(preview.name))
+
+        self.post('full_image', self.image)
+        self.assertEqual(self.get_image_files().count(), 1)
+        self.assertFalse(EpiCollectMedia.objects.exists())
+        self.assertFalse(preview.storage.exists(preview.name))
+
+    @override_settings(EPICOLLECT_THUMBNAIL_POLICY='replace')
+    def test_replace(self):
+        self.post('thumbnail', self.thumbnail)
+        thumbnail = self.get_image_files().get()
+        self.assertEqual(
+            EpiCollectMedia.objects.get(pk=self.pending.pk).thumbnail,
+            thumbnail
+        )
+
+        self.post('full_image', self.image)
+        self.assertEqual(
+            self.get_image_files().exclude(status='deleted').count(), 1)
+        self.assertEqual(
+            ImageFile.objects.get(pk=thumbnail.pk).status, 'deleted')
+        self.assertFalse(EpiCollectMedia.objects.exists())
+
+    @override_settings(EPICOLLECT_THUMBNAIL_POLICY='keep')
+    def test_unknown(self):
+        with self.assertRaises(ImproperlyConfigured):
+            self.post('thumbnail', self.thumbnail)
+
+        self.assertEqual(self.get_image_files().count(), 0)
+        self.assertTrue(EpiCollectMedia.objects.exists())
+
+
+class BatchUploadTest(APITestCase):
+    def setUp(self):
+        user_cache.clear()
+        if not User.objects.filter(display_name='AnonymousUser').exists():
+            UserFactory.create(display_name='AnonymousUser')
+
+        self.project = ProjectFactory.create(
+            **{'isprivate': False, 'everyone_contributes': True}
+        )
+        EpiCollectProjectModel.objects.create(
+            project=self.project, enabled=True)
+        self.category = CategoryFactory.create(**{'project': self.project})
+        self.field = TextFieldFactory(**{'category': self.category})
+
+    def get_entry(self, unique_id, **kwargs):
+        entry = {
+            'location_lat': '51.5175205',
+            'location_lon': '-0.1729205',
+            'category': str(self.category.id),
+            'unique_id': unique_id,
+            '%s_%s' % (self.field.key, self.category.id): 'Westbourne Park'
+        }
+        entry.update(kwargs)
+        return entry
+
+    def post(self, entries, project_id=None):
+        project_id = project_id or self.project.id
+        factory = APIRequestFactory()
+        url = reverse('geokey_epicollect:upload_batch', kwargs={
+            'project_id': project_id
+        })
+        request = factory.post(url + '?phoneid=abc', entries, format='json')
+
+        view = EpiCollectBatchUploadView.as_view()
+        return view(request, project_id=project_id)
+
+    def test_upload_batch(self):
+        response = self.post([
+            self.get_entry('1', photo='a.jpg', video='a.mp4'),
+            self.get_entry('2'),
+            self.get_entry('3', photo='c.jpg')
+        ])
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content), [
+            {'unique_id': '1', 'status': 1},
+            {'unique_id': '2', 'status': 1},
+            {'unique_id': '3', 'status': 1}
+        ])
+        self.assertEqual(self.project.observations.count(), 3)
+        self.assertEqual(
+            EpiCollectMedia.objects.filter(project=self.project).count(), 3)
+
+    def test_upload_batch_with_invalid_entries(self):
+        response = self.post([
+            self.get_entry('1'),
+            self.get_entry('2', category='abc'),
+            self.get_entry('3', location_lat=None, location_lon=None),
+            self.get_entry('4', category='999999')
+        ])
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [entry['status'] for entry in json.loads(response.content)],
+            [1, 0, 0, 0]
+        )
+        self.assertEqual(self.project.observations.count(), 1)
+
+    def test_upload_batch_twice(self):
+        entries = [
+            self.get_entry('1', photo='a.jpg'),
+            self.get_entry('1', photo='a.jpg'),
+            self.get_entry('2')
+        ]
+
+        self.post(entries)
+        response = self.post(entries)
+
+        self.assertEqual(
+            [entry['status'] for entry in json.loads(response.content)],
+            [1, 1, 1]
+        )
+        self.assertEqual(self.project.observations.count(), 2)
+        self.assertEqual(EpiCollectMedia.objects.count(), 1)
+
+    def test_upload_batch_to_disabled_project(self):
+        project = ProjectFactory.create()
+        EpiCollectProjectModel.objects.create(project=project, enabled=False)
+
+        response = self.post([self.get_entry('1')], project_id=project.id)
+        self.assertEqual(response.status_code, 403)
+
+    def test_upload_batch_not_a_list(self):
+        response = self.post({'entries': []})
+        self.assertEqual(response.status_code, 400)
+
+
 class DownloadDataTest(APITestCase):
     def test_download_data(self):
         project = ProjectFactory.create(**{'isprivate': False})
@@ -436,6 +934,10 @@ class DownloadDataTest(APITestCase):
         view = EpiCollectDownloadView.as_view()
         response = view(request, project_id=project.id)
         self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+
+        xml = etree.fromstring(''.join(response.streaming_content))
+        self.assertEqual(len(xml.findall('entry')), 20)
 
     def test_download_data_as_tsv(self):
         project = ProjectFactory.create(**{'isprivate': False})
@@ -451,6 +953,280 @@ class DownloadDataTest(APITestCase):
         view = EpiCollectDownloadView.as_view()
         response = view(request, project_id=project.id)
         self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(
+            ''.join(response.streaming_content).count('\n'), 20)
+
+    def test_download_data_from_snapshot(self):
+        project = ProjectFactory.create(**{'isprivate': False})
+        EpiCollectProjectModel.objects.create(project=project, enabled=True)
+        ObservationFactory.create_batch(
+            20, **{'project': project, 'properties': {'key': 'value'}})
+        self.assertEqual(EpiCollectExportRow.objects.count(), 20)
+
+        factory = APIRequestFactory()
+        url = reverse('geokey_epicollect:download', kwargs={
+            'project_id': project.id
+        })
+        view = EpiCollectDownloadView.as_view()
+        serializer = DataSerializer()
+
+        response = view(factory.get(url), project_id=project.id)
+        self.assertEqual(
+            ''.join(response.streaming_content),
+            ''.join(serializer.stream_xml(project))
+        )
+
+        response = view(factory.get(url + '?xml=false'), project_id=project.id)
+        self.assertEqual(
+            ''.join(response.streaming_content),
+            ''.join(serializer.stream_tsv(project))
+        )
+
+    def test_download_data_with_outdated_snapshot(self):
+        project = ProjectFactory.create(**{'isprivate': False})
+        EpiCollectProjectModel.objects.create(project=project, enabled=True)
+        ObservationFactory.create_batch(
+            5, **{'project': project, 'properties': {'key': 'value'}})
+        EpiCollectExportRow.objects.all().delete()
+
+        factory = APIRequestFactory()
+        url = reverse('geokey_epicollect:download', kwargs={
+            'project_id': project.id
+        })
+        response = EpiCollectDownloadView.as_view()(
+            factory.get(url), project_id=project.id)
+
+        xml = etree.fromstring(''.join(response.streaming_content))
+        self.assertEqual(len(xml.findall('entry')), 5)
+
+    def test_download_data_after_reenabling(self):
+        project = ProjectFactory.create(**{'isprivate': False})
+        epicollect = EpiCollectProjectModel.objects.create(
+            project=project, enabled=True)
+        observation = ObservationFactory.create_batch(
+            5, **{'project': project, 'properties': {'key': 'value'}})[0]
+
+        epicollect.enabled = False
+        epicollect.save()
+        observation.update({'key': 'changed'}, project.creator)
+        epicollect.enabled = True
+        epicollect.save()
+
+        factory = APIRequestFactory()
+        url = reverse('geokey_epicollect:download', kwargs={
+            'project_id': project.id
+        })
+        response = EpiCollectDownloadView.as_view()(
+            factory.get(url), project_id=project.id)
+
+        content = ''.join(response.streaming_content)
+        self.assertIn('changed', content)
+        self.assertEqual(
+            content, ''.join(DataSerializer().stream_xml(project)))
+
+    @override_settings(CACHES={'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_download_data_not_modified(self):
+        cache.clear()
+        project = ProjectFactory.create(**{'isprivate': False})
+        EpiCollectProjectModel.objects.create(project=project, enabled=True)
+        ObservationFactory.create_batch(
+            5, **{'project': project, 'properties': {'key': 'value'}})
+
+        factory = APIRequestFactory()
+        url = reverse('geokey_epicollect:download', kwargs={
+            'project_id': project.id
+        })
+        view = EpiCollectDownloadView.as_view()
+
+        response = view(factory.get(url), project_id=project.id)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+
+        response = view(
+            factory.get(url, HTTP_IF_NONE_MATCH=etag), project_id=project.id)
+        self.assertEqual(response.status_code, 304)
+        self.assertFalse(response.content)
+
+        response = view(
+            factory.get(url + '?xml=false', HTTP_IF_NONE_MATCH=etag),
+            project_id=project.id
+        )
+        self.assertEqual(response.status_code, 200)
+
+        ObservationFactory.create(
+            **{'project': project, 'properties': {'key': 'value'}})
+        response = view(
+            factory.get(url, HTTP_IF_NONE_MATCH=etag), project_id=project.id)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    @override_settings(CACHES={'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_download_data_last_modified(self):
+        cache.clear()
+        project = ProjectFactory.create(**{'isprivate': False})
+        EpiCollectProjectModel.objects.create(project=project, enabled=True)
+        ObservationFactory.create_batch(
+            2, **{'project': project, 'properties': {'key': 'value'}})
+        changed = timezone.now() - timedelta(days=1)
+        project.observations.update(updated_at=changed)
+
+        # Deleting leaves updated_at as it is
+        project.observations.first().delete()
+
+        view = EpiCollectDownloadView()
+        stats = view.get_stats(project)
+        etag, last_modified = view.get_validators(
+            APIRequestFactory().get('/'), project, stats)
+        self.assertEqual(
+            last_modified,
+            get_version_timestamp(get_data_version(project.id))
+        )
+
+    @override_settings(CACHES={'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_download_data_deleted_in_other_process(self):
+        cache.clear()
+        project = ProjectFactory.create(**{'isprivate': False})
+        EpiCollectProjectModel.objects.create(project=project, enabled=True)
+        ObservationFactory.create_batch(
+            2, **{'project': project, 'properties': {'key': 'value'}})
+
+        factory = APIRequestFactory()
+        url = reverse('geokey_epicollect:download', kwargs={
+            'project_id': project.id
+        })
+        view = EpiCollectDownloadView.as_view()
+        response = view(factory.get(url), project_id=project.id)
+
+        # Deleted without the data version of this process being replaced
+        project.observations.filter(
+            id=project.observations.first().id).update(status='deleted')
+
+        response = view(
+            factory.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']),
+            project_id=project.id
+        )
+        self.assertEqual(response.status_code, 200)
+        xml = etree.fromstring(''.join(response.streaming_content))
+        self.assertEqual(len(xml.findall('entry')), 1)
+
+    def test_download_data_since_cursor(self):
+        project = ProjectFactory.create(**{'isprivate': False})
+        EpiCollectProjectModel.objects.create(project=project, enabled=True)
+        ObservationFactory.create_batch(
+            5, **{'project': project, 'properties': {'key': 'value'}})
+
+        factory = APIRequestFactory()
+        url = reverse('geokey_epicollect:download', kwargs={
+            'project_id': project.id
+        })
+        view = EpiCollectDownloadView.as_view()
+
+        # Older than the overlap the cursor is set back by
+        changed = timezone.now() - timedelta(seconds=CURSOR_OVERLAP + 60)
+        project.observations.update(created_at=changed, updated_at=changed)
+
+        response = view(factory.get(url), project_id=project.id)
+        cursor = response['X-EpiCollect-Cursor']
+        ObservationFactory.create_batch(
+            2, **{'project': project, 'properties': {'key': 'value'}})
+
+        response = view(
+            factory.get(url, {'since': cursor}), project_id=project.id)
+        self.assertEqual(response.status_code, 200)
+        xml = etree.fromstring(''.join(response.streaming_content))
+        self.assertEqual(len(xml.findall('entry')), 2)
+        self.assertEqual(
+            xml.find('table').find('cursor').text,
+            response['X-EpiCollect-Cursor']
+        )
+
+        response = view(
+            factory.get(url, {'since': cursor, 'xml': 'false'}),
+            project_id=project.id
+        )
+        tsv = ''.join(response.streaming_content)
+        self.assertEqual(tsv.count('\n'), 3)
+        self.assertTrue(tsv.endswith(
+            'cursor\t%s\t\n' % response['X-EpiCollect-Cursor']))
+
+        # Entries changed within the overlap are sent again
+        response = view(
+            factory.get(url, {'since': response['X-EpiCollect-Cursor']}),
+            project_id=project.id
+        )
+        xml = etree.fromstring(''.join(response.streaming_content))
+        self.assertEqual(len(xml.findall('entry')), 2)
+
+    def test_download_data_since_invalid_value(self):
+        project = ProjectFactory.create(**{'isprivate': False})
+        EpiCollectProjectModel.objects.create(project=project, enabled=True)
+
+        factory = APIRequestFactory()
+        url = reverse('geokey_epicollect:download', kwargs={
+            'project_id': project.id
+        })
+        view = EpiCollectDownloadView.as_view()
+        response = view(
+            factory.get(url, {'since': 'yesterday'}), project_id=project.id)
+        self.assertEqual(response.status_code, 400)
+
+    def test_download_data_in_pages(self):
+        project = ProjectFactory.create(**{'isprivate': False})
+        EpiCollectProjectModel.objects.create(project=project, enabled=True)
+        observations = ObservationFactory.create_batch(
+            5, **{'project': project, 'properties': {'key': 'value'}})
+        ids = sorted(observation.id for observation in observations)
+
+        factory = APIRequestFactory()
+        url = reverse('geokey_epicollect:download', kwargs={
+            'project_id': project.id
+        })
+        view = EpiCollectDownloadView.as_view()
+
+        response = view(factory.get(url, {'limit': 2}), project_id=project.id)
+        xml = etree.fromstring(''.join(response.streaming_content))
+        self.assertEqual(
+            [int(entry.find('id').text) for entry in xml.findall('entry')],
+            ids[:2]
+        )
+        self.assertEqual(
+            xml.find('table').find('next_after_id').text, str(ids[1]))
+        self.assertEqual(response['X-EpiCollect-Next-After-Id'], str(ids[1]))
+
+        response = view(
+            factory.get(url, {'after_id': ids[1], 'limit': 2, 'xml': 'false'}),
+            project_id=project.id
+        )
+        tsv = ''.join(response.streaming_content)
+        self.assertEqual(tsv.count('\n'), 3)
+        self.assertTrue(tsv.endswith('next_after_id\t%s\t\n' % ids[3]))
+
+        response = view(
+            factory.get(url, {'after_id': ids[3], 'limit': 2}),
+            project_id=project.id
+        )
+        xml = etree.fromstring(''.join(response.streaming_content))
+        self.assertEqual(len(xml.findall('entry')), 1)
+        self.assertIsNone(xml.find('table').find('next_after_id'))
+        self.assertFalse(response.has_header('X-EpiCollect-Next-After-Id'))
+
+    def test_download_data_with_invalid_page(self):
+        project = ProjectFactory.create(**{'isprivate': False})
+        EpiCollectProjectModel.objects.create(project=project, enabled=True)
+
+        factory = APIRequestFactory()
+        url = reverse('geokey_epicollect:download', kwargs={
+            'project_id': project.id
+        })
+        view = EpiCollectDownloadView.as_view()
+
+        for params in [{'limit': 0}, {'limit': 'all'}, {'after_id': -1}]:
+            response = view(factory.get(url, params), project_id=project.id)
+            self.assertEqual(response.status_code, 400)
 
     def test_download_data_non_existing_project(self):
         factory = APIRequestFactory()
@@ -0,0 +1,161 @@
+"""
+Converts entries uploaded by EpiCollect's mobile app into GeoKey
+contributions. The fields of a category are compiled into a
+`CategorySchema` once and kept in a process-local LRU cache, so that an
+upload neither queries the category and its fields nor decides again how
+each field value is converted.
+"""
+import json
+
+from datetime import datetime
+
+from django.conf import settings
+
+from geokey.categories.models import Category
+from geokey.contributions.serializers import ContributionSerializer
+
+from . import metrics
+from .cache import LRUCache, get_schema_version
+
+
+def convert_multiple_lookup(value):
+    return json.loads('[' + value + ']')
+
+
+def convert_date(value):
+    return datetime.strptime(value, '%d/%m/%Y').strftime('%Y-%m-%d')
+
+
+CONVERTERS = {
+    'MultipleLookupField': convert_multiple_lookup,
+    'DateField': convert_date,
+    'DateTimeField': convert_date
+}
+
+
+class CategorySchema(object):
+    """
+    The upload schema of a category: the key of each field, the key of the
+    field in EpiCollect's form (`key_categoryid`) and the function that
+    converts the uploaded value, if any.
+    """
+    def __init__(self, category, version):
+        self.category_id = category.id
+        self.project_id = category.project_id
+        self.version = version
+        self.fields = [
+            (
+                field.key,
+                '%s_%s' % (field.key.replace('-', '_'), category.id),
+                CONVERTERS.get(field.fieldtype)
+            )
+            for field in category.fields.all()
+        ]
+
+    def convert(self, data):
+        """
+        Returns the contribution properties for the uploaded form data.
+        """
+        properties = {}
+
+        for key, form_key, converter in self.fields:
+            value = data.get(form_key)
+            if converter is not None:
+                value = converter(value)
+
+            properties[key] = value
+
+        return properties
+
+
+# Schemas also expire, so that a schema version replaced by another process
+# is seen even if the cache backend is local to the process
+schema_cache = LRUCache(
+    getattr(settings, 'EPICOLLECT_SCHEMA_CACHE_SIZE', 256),
+    getattr(settings, 'EPICOLLECT_LOOKUP_CACHE_TIMEOUT', 60)
+)
+
+
+def get_category_schema(category_id):
+    """
+    Returns the upload schema of the category. A cached schema is used as
+    long as the schema version of its project has not changed.
+
+    Raises `TypeError` or `ValueError` if the category ID is not a number and
+    `Category.DoesNotExist` if the category does not exist.
+    """
+    category_id = int(category_id)
+    schema = schema_cache.get(category_id)
+
+    if (schema is not None and
+            schema.version == get_schema_version(schema.project_id)):
+        metrics.increment(
+            'epicollect_cache_total', cache='schema', result='hit')
+        return schema
+
+    metrics.increment(
+        'epicollect_cache_total', cache='schema', result='miss')
+
+    category = Category.objects.get(pk=category_id)
+    # The version is read before the fields are, so that fields changing in
+    # between replace the version and the schema is compiled again
+    schema = CategorySchema(category, get_schema_version(category.project_id))
+    schema_cache.set(category_id, schema)
+
+    return schema
+
+
+def invalidate_category_schemas(project_id):
+    """
+    Removes the cached upload schemas of all categories of the project.
+    """
+    schema_cache.discard(lambda schema: schema.project_id == project_id)
+
+
+def build_contribution(schema, data, device_id):
+    """
+    Returns the data for `ContributionSerializer` for the uploaded form
+    data. Raises `TypeError` if the location is missing.
+    """
+    lng = float(data.get('location_lon'))
+    lat = float(data.get('location_lat'))
+
+    contribution = {
+        'type': 'Feature',
+        'location': {
+            'geometry': ('{"type": "Point", "coordinates": '
+                         '[%s, %s]}' % (lng, lat))
+        },
+        'properties': {
+            'location_acc': data.get('location_acc'),
+            'location_provider': data.get('location_provider'),
+            'location_alt': data.get('location_alt'),
+            'location_bearing': data.get('location_bearing'),
+            'unique_id': data.get('unique_id'),
+            'DeviceID': device_id
+        },
+        'meta': {
+            'category': data.get('category'),
+        }
+    }
+
+    contribution['properties'].update(schema.convert(data))
+    return contribution
+
+
+def get_contribution_serializer(project, user, data, device_id):
+    """
+    Returns the `ContributionSerializer` for an uploaded entry. Raises
+    `Category.DoesNotExist`, `TypeError` or `ValueError` if the entry's
+    category or location is missing or not valid.
+    """
+    with metrics.timer('upload', 'category'):
+        schema = get_category_schema(data.get('category'))
+
+    with metrics.timer('upload', 'convert'):
+        contribution = build_contribution(schema, data, device_id)
+
+    return ContributionSerializer(
+        data=contribution,
+        context={'user': user, 'project': project}
+    )
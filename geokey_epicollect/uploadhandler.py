@@ -0,0 +1,32 @@
+"""
+Upload handler for media sent by EpiCollect's mobile app. Files are streamed
+to a temporary file in fixed-size chunks, whatever their size, so that a
+large video is never held in memory. The SHA-256 digest of the content is
+computed from the same chunks while they are written.
+"""
+import hashlib
+
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+
+
+class HashingFileUploadHandler(TemporaryFileUploadHandler):
+    """
+    Writes uploaded files to a temporary file and sets the hex digest of
+    their content as `sha256` on the `TemporaryUploadedFile`.
+    """
+    chunk_size = 64 * 2 ** 10
+
+    def new_file(self, *args, **kwargs):
+        super(HashingFileUploadHandler, self).new_file(*args, **kwargs)
+        self.hash = hashlib.sha256()
+
+    def receive_data_chunk(self, raw_data, start):
+        self.hash.update(raw_data)
+        return super(HashingFileUploadHandler, self).receive_data_chunk(
+            raw_data, start)
+
+    def file_complete(self, file_size):
+        uploaded_file = super(HashingFileUploadHandler, self).file_complete(
+            file_size)
+        uploaded_file.sha256 = self.hash.hexdigest()
+        return uploaded_file
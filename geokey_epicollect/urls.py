@@ -1,7 +1,8 @@
 from django.conf.urls import url
 
 from views import (
-    IndexPage, EpiCollectProject, EpiCollectUploadView, EpiCollectDownloadView
+    IndexPage, EpiCollectProject, EpiCollectUploadView,
+    EpiCollectBatchUploadView, EpiCollectDownloadView, EpiCollectMetricsView
 )
 
 urlpatterns = [
@@ -20,5 +21,13 @@ urlpatterns = [
     url(
         r'^api/epicollect/projects/(?P<project_id>[0-9]+)/upload/$',
         EpiCollectUploadView.as_view(),
-        name='upload')
+        name='upload'),
+    url(
+        r'^api/epicollect/projects/(?P<project_id>[0-9]+)/upload/batch/$',
+        EpiCollectBatchUploadView.as_view(),
+        name='upload_batch'),
+    url(
+        r'^api/epicollect/metrics/$',
+        EpiCollectMetricsView.as_view(),
+        name='metrics')
 ]
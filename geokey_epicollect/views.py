@@ -1,9 +1,19 @@
-import json
+import hashlib
+import calendar
 
-from datetime import datetime
+from datetime import timedelta
 
-from django.http import HttpResponse
-from django.views.generic import TemplateView
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured, ValidationError
+from django.db import DatabaseError, transaction
+from django.db.models import Count, Max
+from django.http import (
+    Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+)
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from django.views.generic import TemplateView, View
 from braces.views import LoginRequiredMixin
 
 from lxml import etree
@@ -12,24 +22,51 @@ from rest_framework.views import APIView
 
 from geokey.projects.models import Project
 from geokey.categories.models import Category
-from geokey.contributions.serializers import ContributionSerializer
-from geokey.contributions.models import ImageFile, MediaFile
-from geokey.users.models import User
+from geokey.contributions.models import ImageFile, MediaFile, VideoFile
 
 from serializer import ProjectFormSerializer, DataSerializer
+from .cursors import create_cursor, parse_since
+from .upload import get_contribution_serializer
+from . import metrics
+from .staging import stage_entry
+from .uploadhandler import HashingFileUploadHandler
+from .cache import (
+    get_schema_version, get_data_version, get_version_timestamp,
+    get_cached_form, set_cached_form, is_shared_cache
+)
 from .models import (
+    project_cache,
+    user_cache,
+    EpiCollectExportRow,
     EpiCollectMedia,
-    EpiCollectProject as EpiCollectProjectModel
+    EpiCollectMediaHash,
+    EpiCollectSubmission,
+    EpiCollectProject as EpiCollectProjectModel,
+    get_enabled_project,
+    get_anonymous_user
 )
 
 
+DOWNLOAD_MAX_LIMIT = getattr(settings, 'EPICOLLECT_DOWNLOAD_MAX_LIMIT', 1000)
+BATCH_MAX_ENTRIES = getattr(settings, 'EPICOLLECT_BATCH_MAX_ENTRIES', 500)
+CURSOR_OVERLAP = getattr(settings, 'EPICOLLECT_CURSOR_OVERLAP', 300)
+THUMBNAIL_POLICIES = ('store', 'drop', 'preview', 'replace')
+
+
 class IndexPage(LoginRequiredMixin, TemplateView):
     template_name = 'epicollect_index.html'
     exception_message = 'Managing Community Maps is for super-users only.'
 
     def get_context_data(self, *args, **kwargs):
-        projects = Project.objects.filter(admins=self.request.user)
-        enabled = EpiCollectProjectModel.objects.filter(project__in=projects)
+        # The EpiCollect settings are joined, so that the template does not
+        # query them for each project
+        projects = list(Project.objects.filter(
+            admins=self.request.user
+        ).select_related('epicollect'))
+        enabled = [
+            project.epicollect for project in projects
+            if hasattr(project, 'epicollect') and project.epicollect.enabled
+        ]
 
         return super(IndexPage, self).get_context_data(
             projects=projects,
@@ -41,182 +78,652 @@ class IndexPage(LoginRequiredMixin, TemplateView):
         )
 
     def update_projects(self, projects, enabled, form=[]):
-        for p in projects:
-            if p in enabled and not str(p.id) in form:
-                EpiCollectProjectModel.objects.get(project=p).delete()
-            elif p not in enabled and str(p.id) in form:
-                EpiCollectProjectModel.objects.create(project=p, enabled=True)
+        """
+        Enables the projects selected in the form and disables the others,
+        with one delete each of export rows and settings, one update and one
+        insert. `enabled` are the IDs of the projects that are enabled now;
+        projects with disabled EpiCollect settings are enabled again rather
+        than inserted twice.
+        """
+        project_ids = set(project.id for project in projects)
+        existing = set(
+            project.id for project in projects
+            if hasattr(project, 'epicollect')
+        )
+        selected = set(
+            int(project_id) for project_id in form if project_id.isdigit()
+        ) & project_ids
+        enabled = set(enabled)
+
+        with transaction.atomic():
+            # Deleting settings in bulk bypasses `EpiCollectProject.delete()`
+            EpiCollectExportRow.objects.filter(
+                project_id__in=enabled - selected
+            ).delete()
+            EpiCollectProjectModel.objects.filter(
+                project_id__in=enabled - selected
+            ).delete()
+            EpiCollectProjectModel.objects.filter(
+                project_id__in=(selected & existing) - enabled
+            ).update(enabled=True)
+            EpiCollectProjectModel.objects.bulk_create([
+                EpiCollectProjectModel(project_id=project_id, enabled=True)
+                for project_id in selected - existing
+            ])
+
+        # update() and bulk_create() do not send post_save
+        for project_id in selected - enabled:
+            project_cache.discard(project_id)
 
     def post(self, request):
         context = self.get_context_data()
         self.update_projects(
             context.get('projects'),
-            [epi.project for epi in context.get('epicollect')],
+            [epi.project_id for epi in context.get('epicollect')],
             self.request.POST.getlist('epicollect_project')
         )
-        return self.render_to_response(context)
+        return self.render_to_response(self.get_context_data())
+
+
+class ConditionalResponseMixin(object):
+    """
+    Answers conditional GET requests. The validators are computed without
+    serialising anything, so an unchanged resource is answered with `304 Not
+    Modified` before the serialiser runs.
+    """
+    def get_etag(self, *parts):
+        """
+        Returns a strong ETag derived from the given parts.
+        """
+        return quote_etag(hashlib.md5(
+            ':'.join([unicode(part) for part in parts]).encode('utf-8')
+        ).hexdigest())
+
+    def get_not_modified_response(self, request, etag, last_modified,
+                                  compare_last_modified=True):
+        """
+        Returns a `304 Not Modified` response if the client's copy is up to
+        date, otherwise `None`. If `compare_last_modified` is false, only the
+        ETag is compared, i.e. `If-Modified-Since` is ignored.
+        """
+        response = get_conditional_response(
+            request,
+            etag=etag,
+            last_modified=last_modified if compare_last_modified else None
+        )
 
+        if response is not None:
+            self.set_validators(response, etag, last_modified)
 
-class EpiCollectProject(APIView):
-    def get(self, request, project_id):
-        try:
-            epicollect = EpiCollectProjectModel.objects.get(pk=project_id)
+        return response
+
+    def set_validators(self, response, etag, last_modified):
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        return response
 
-            serializer = ProjectFormSerializer()
-            xml = serializer.serialize(epicollect.project, request.get_host())
-            return HttpResponse(
-                etree.tostring(xml), content_type='text/xml; charset=utf-8')
 
-        except EpiCollectProjectModel.DoesNotExist:
+class EpiCollectProject(ConditionalResponseMixin, APIView):
+    def get(self, request, project_id):
+        with metrics.timer('form', 'lookup'):
+            project = get_enabled_project(project_id)
+        if project is None:
             return HttpResponse(
                 '<error>The project must enabled for EpiCollect.</error>',
                 content_type='text/xml; charset=utf-8',
                 status=status.HTTP_403_FORBIDDEN
             )
 
+        host = request.get_host()
+        version = get_schema_version(project.id)
+        etag = self.get_etag(version, host)
+        last_modified = get_version_timestamp(version)
+
+        response = self.get_not_modified_response(
+            request, etag, last_modified)
+        if response is not None:
+            metrics.increment('epicollect_not_modified_total', view='form')
+            return response
+
+        with metrics.timer('form', 'cache'):
+            xml = get_cached_form(project.id, host, version)
+
+        if xml is None:
+            metrics.increment(
+                'epicollect_cache_total', cache='form', result='miss')
+
+            with metrics.timer('form', 'serialize'):
+                serializer = ProjectFormSerializer()
+                xml = etree.tostring(serializer.serialize(project, host))
+            set_cached_form(project.id, host, version, xml)
+        else:
+            metrics.increment(
+                'epicollect_cache_total', cache='form', result='hit')
+
+        metrics.increment(
+            'epicollect_bytes_emitted_total', len(xml), view='form')
+
+        return self.set_validators(
+            HttpResponse(xml, content_type='text/xml; charset=utf-8'),
+            etag,
+            last_modified
+        )
+
+
+def get_thumbnail_policy():
+    """
+    Returns `EPICOLLECT_THUMBNAIL_POLICY`. Unknown policies raise
+    `ImproperlyConfigured` rather than silently dropping thumbnails.
+    """
+    policy = getattr(settings, 'EPICOLLECT_THUMBNAIL_POLICY', 'store')
+
+    if policy not in THUMBNAIL_POLICIES:
+        raise ImproperlyConfigured(
+            'EPICOLLECT_THUMBNAIL_POLICY must be one of %s, not %r.' % (
+                ', '.join(THUMBNAIL_POLICIES), policy)
+        )
+
+    return policy
+
 
 class EpiCollectUploadView(APIView):
+    def initialize_request(self, request, *args, **kwargs):
+        # Must be set before the request body is parsed
+        request.upload_handlers = [HashingFileUploadHandler(request)]
+        return super(EpiCollectUploadView, self).initialize_request(
+            request, *args, **kwargs)
+
+    def create_image_file(self, user, contribution, the_file):
+        """
+        Creates the image file. An image that has been stored before is
+        linked to the stored file instead of being written again.
+        """
+        digest = getattr(the_file, 'sha256', None)
+        stored = EpiCollectMediaHash.objects.get_stored(digest, 'image')
+
+        image_file = ImageFile.objects.create(
+            name=the_file.name,
+            description='',
+            creator=user,
+            contribution=contribution,
+            image=stored.stored_file.name if stored else the_file
+        )
+
+        if stored is None:
+            EpiCollectMediaHash.objects.record(digest, 'image', image_file)
+
+        return image_file
+
+    def create_video_file(self, user, contribution, the_file):
+        """
+        Uploads the video to YouTube straight from the temporary file it has
+        been streamed to, which is then moved to the media storage. GeoKey's
+        `_create_video_file` would read the whole video into memory and
+        write another copy first. A video that has been stored before is
+        linked to the stored file and its YouTube video instead.
+        """
+        digest = getattr(the_file, 'sha256', None)
+        stored = EpiCollectMediaHash.objects.get_stored(digest, 'video')
+
+        if stored is not None:
+            video_file = stored.media_file.videofile
+            return VideoFile.objects.create(
+                name=the_file.name,
+                description='',
+                creator=user,
+                contribution=contribution,
+                video=video_file.video.name,
+                youtube_id=video_file.youtube_id,
+                youtube_link=video_file.youtube_link,
+                swf_link=video_file.swf_link
+            )
+
+        if not hasattr(the_file, 'temporary_file_path'):
+            return MediaFile.objects._create_video_file(
+                the_file.name, '', user, contribution, the_file)
+
+        video_id, swf_link = MediaFile.objects._upload_to_youtube(
+            the_file.name,
+            the_file.temporary_file_path()
+        )
+
+        video_file = VideoFile.objects.create(
+            name=the_file.name,
+            description='',
+            creator=user,
+            contribution=contribution,
+            video=the_file,
+            youtube_id=video_id,
+            youtube_link='https://www.youtube.com/embed/' + video_id,
+            swf_link=swf_link
+        )
+        EpiCollectMediaHash.objects.record(digest, 'video', video_file)
+
+        return video_file
+
     def post(self, request, project_id):
-        try:
-            epicollect = EpiCollectProjectModel.objects.get(pk=project_id)
-        except EpiCollectProjectModel.DoesNotExist:
+        with metrics.timer('upload', 'lookup'):
+            project = get_enabled_project(project_id)
+        if project is None:
             return HttpResponse('0')
 
-        user = User.objects.get(display_name='AnonymousUser')
+        user = get_anonymous_user()
         upload_type = request.GET.get('type')
+        metrics.increment(
+            'epicollect_uploads_total', type=upload_type or 'data')
+        thumbnail_policy = get_thumbnail_policy()
 
-        if upload_type in ['thumbnail', 'full_image']:
+        if upload_type == 'thumbnail' and thumbnail_policy != 'store':
             the_file = request.FILES.get('name')
 
-            try:
-                epicollect_file = EpiCollectMedia.objects.get(
-                    file_name=the_file.name
-                )
-            except EpiCollectMedia.DoesNotExist:
+            epicollect_file = EpiCollectMedia.objects.get_pending(
+                project.id, the_file.name)
+            if epicollect_file is None:
                 return HttpResponse('0')
 
-            ImageFile.objects.create(
-                name=the_file.name,
-                description='',
-                creator=user,
-                contribution=epicollect_file.contribution,
-                image=the_file
-            )
+            # The entry stays pending until the full image arrives
+            with metrics.timer('upload', 'media'):
+                if (thumbnail_policy == 'preview' and
+                        not epicollect_file.preview):
+                    epicollect_file.preview.save(the_file.name, the_file)
+                elif (thumbnail_policy == 'replace' and
+                        epicollect_file.thumbnail_id is None):
+                    epicollect_file.thumbnail = self.create_image_file(
+                        user, epicollect_file.contribution, the_file)
+                    epicollect_file.save(update_fields=['thumbnail'])
+
+            return HttpResponse('1')
+
+        if upload_type in ['thumbnail', 'full_image']:
+            the_file = request.FILES.get('name')
+
+            epicollect_file = EpiCollectMedia.objects.get_pending(
+                project.id, the_file.name)
+            if epicollect_file is None:
+                return HttpResponse('0')
 
-            epicollect_file.delete()
+            with metrics.timer('upload', 'media'):
+                self.create_image_file(
+                    user, epicollect_file.contribution, the_file)
+                epicollect_file.remove_thumbnail()
+                epicollect_file.delete()
 
             return HttpResponse('1')
 
         elif upload_type == 'video':
             the_file = request.FILES.get('name')
 
-            try:
-                epicollect_file = EpiCollectMedia.objects.get(
-                    file_name=the_file.name
-                )
-            except EpiCollectMedia.DoesNotExist:
+            epicollect_file = EpiCollectMedia.objects.get_pending(
+                project.id, the_file.name)
+            if epicollect_file is None:
                 return HttpResponse('0')
 
-            MediaFile.objects._create_video_file(
-                the_file.name,
-                '',
-                user,
-                epicollect_file.contribution,
-                the_file
-            )
-            epicollect_file.delete()
+            with metrics.timer('upload', 'media'):
+                self.create_video_file(
+                    user, epicollect_file.contribution, the_file)
+                epicollect_file.delete()
             return HttpResponse('1')
 
         data = request.POST
+        unique_id = data.get('unique_id')
+
+        with metrics.timer('upload', 'dedupe'):
+            uploaded = EpiCollectSubmission.objects.get_uploaded(
+                project.id, [unique_id])
+        if uploaded:
+            # The entry has been uploaded before, e.g. by a retry
+            metrics.increment('epicollect_duplicate_uploads_total')
+            return HttpResponse('1')
+
+        if getattr(settings, 'EPICOLLECT_ASYNC_UPLOADS', False):
+            stage_entry(project, data.dict(), request.GET.get('phoneid'))
+            return HttpResponse('1')
 
         try:
-            category = Category.objects.get(pk=data.get('category'))
+            contribution = get_contribution_serializer(
+                project, user, data, request.GET.get('phoneid'))
         except Category.DoesNotExist:
             return HttpResponse('0')
-        except ValueError:
-            # The value provided for category is not a number
+        except (TypeError, ValueError):
+            # The category is not a number or the location is missing
             return HttpResponse('0')
 
+        with metrics.timer('upload', 'validate'):
+            valid = contribution.is_valid(raise_exception=True)
+
+        if valid:
+            with metrics.timer('upload', 'save'):
+                saved = EpiCollectSubmission.objects.save_entry(
+                    project, contribution, unique_id)
+
+            if saved:
+                with metrics.timer('upload', 'media'):
+                    EpiCollectMedia.objects.bulk_create(
+                        EpiCollectMedia.objects.for_entry(
+                            project, contribution.instance, data)
+                    )
+
+        return HttpResponse('1')
+
+
+def get_unique_id(data):
+    unique_id = data.get('unique_id') if isinstance(data, dict) else None
+    return unique_id if isinstance(unique_id, basestring) else None
+
+
+class EpiCollectBatchUploadView(APIView):
+    """
+    Uploads many entries in one request. The body is a JSON list of entries,
+    each with the same keys as the form data of a single upload. All entries
+    are validated first and then saved in one transaction; an entry that
+    fails does not stop the others. Responds with the status of each entry,
+    in the order of the request: `1` if it has been saved or had been
+    uploaded before, otherwise `0`.
+    """
+    def validate_entry(self, project, user, data, device_id):
+        """
+        Returns the validated `ContributionSerializer` for the entry, or
+        `None` if the entry is not valid.
+        """
         try:
-            lng = float(data.get('location_lon'))
-            lat = float(data.get('location_lat'))
-        except TypeError:
-            return HttpResponse('0')
+            contribution = get_contribution_serializer(
+                project, user, data, device_id)
+        except (Category.DoesNotExist, TypeError, ValueError,
+                AttributeError):
+            return None
+
+        return contribution if contribution.is_valid() else None
 
-        observation = {
-            'type': 'Feature',
-            'location': {
-                'geometry': ('{"type": "Point", "coordinates": '
-                             '[%s, %s]}' % (lng, lat))
-            },
-            'properties': {
-                'location_acc': data.get('location_acc'),
-                'location_provider': data.get('location_provider'),
-                'location_alt': data.get('location_alt'),
-                'location_bearing': data.get('location_bearing'),
-                'unique_id': data.get('unique_id'),
-                'DeviceID': request.GET.get('phoneid')
-            },
-            'meta': {
-                'category': data.get('category'),
-            }
-        }
-
-        for field in category.fields.all():
-            key = field.key.replace('-', '_')
-            value = data.get(key + '_' + str(category.id))
-            if field.fieldtype == 'MultipleLookupField':
-                value = json.loads('[' + value + ']')
-            elif field.fieldtype in ['DateField', 'DateTimeField']:
-                value = datetime.strptime(value, '%d/%m/%Y').strftime('%Y-%m-%d')
-
-            observation['properties'][field.key] = value
-
-        contribution = ContributionSerializer(
-            data=observation,
-            context={'user': user, 'project': epicollect.project}
-        )
-        if contribution.is_valid(raise_exception=True):
-            contribution.save()
-
-        photo_id = data.get('photo')
-        if photo_id is not None:
-            EpiCollectMedia.objects.create(
-                contribution=contribution.instance,
-                file_name=photo_id
+    def post(self, request, project_id):
+        project = get_enabled_project(project_id)
+        if project is None:
+            return HttpResponse(
+                '{"error": "The project must enabled for EpiCollect."}',
+                content_type='application/json',
+                status=status.HTTP_403_FORBIDDEN
             )
 
-        video_id = data.get('video')
-        if video_id is not None:
-            EpiCollectMedia.objects.create(
-                contribution=contribution.instance,
-                file_name=video_id
+        entries = request.data
+        if not isinstance(entries, list) or len(entries) > BATCH_MAX_ENTRIES:
+            return HttpResponse(
+                '{"error": "Expected a list of at most %s entries."}' %
+                BATCH_MAX_ENTRIES,
+                content_type='application/json',
+                status=status.HTTP_400_BAD_REQUEST
             )
 
-        return HttpResponse('1')
+        user = get_anonymous_user()
+        device_id = request.GET.get('phoneid')
+        unique_ids = [get_unique_id(data) for data in entries]
+
+        uploaded = EpiCollectSubmission.objects.get_uploaded(
+            project.id, unique_ids)
+        contributions = [
+            None if unique_id in uploaded
+            else self.validate_entry(project, user, data, device_id)
+            for data, unique_id in zip(entries, unique_ids)
+        ]
+
+        statuses = []
+        media = []
+
+        with transaction.atomic():
+            for data, unique_id, contribution in zip(
+                    entries, unique_ids, contributions):
+                # Also true for entries repeated within the batch
+                if unique_id in uploaded:
+                    statuses.append(1)
+                    continue
+
+                if contribution is None:
+                    statuses.append(0)
+                    continue
+
+                try:
+                    saved = EpiCollectSubmission.objects.save_entry(
+                        project, contribution, unique_id)
+                except (DatabaseError, ValidationError):
+                    statuses.append(0)
+                    continue
+
+                statuses.append(1)
+                if unique_id:
+                    uploaded.add(unique_id)
+                if saved:
+                    media.extend(EpiCollectMedia.objects.for_entry(
+                        project, contribution.instance, data))
+
+            EpiCollectMedia.objects.bulk_create(media)
+
+        return JsonResponse([
+            {'unique_id': unique_id, 'status': entry_status}
+            for unique_id, entry_status in zip(unique_ids, statuses)
+        ], safe=False)
+
+
+class EpiCollectDownloadView(ConditionalResponseMixin, APIView):
+    def get_stats(self, project):
+        """
+        Returns the number of observations of the project and the time of
+        their newest change.
+        """
+        return project.observations.aggregate(
+            count=Count('id'),
+            updated_at=Max('updated_at')
+        )
+
+    def get_validators(self, request, project, stats):
+        """
+        Returns the ETag and the Last-Modified timestamp of the download. The
+        ETag changes with the schema and data versions of the project and
+        with the observations' count and newest change, so that changes not
+        announced by a signal are detected as well. Last-Modified is the
+        time of the newest observation, schema or data change; the data
+        version also changes when observations are deleted or their
+        locations edited, which leaves `updated_at` as it is. Unless the
+        cache is shared, a data version replaced by another process is not
+        seen, so Last-Modified is then not compared (see `get`).
+        """
+        schema_version = get_schema_version(project.id)
+        data_version = get_data_version(project.id)
+
+        etag = self.get_etag(
+            schema_version,
+            data_version,
+            stats['count'],
+            stats['updated_at'],
+            request.GET.urlencode()
+        )
+
+        last_modified = max(
+            get_version_timestamp(schema_version),
+            get_version_timestamp(data_version)
+        )
+        if stats['updated_at'] is not None:
+            last_modified = max(
+                last_modified,
+                calendar.timegm(stats['updated_at'].utctimetuple())
+            )
+
+        return etag, last_modified
+
+    def get_page_parameters(self, request):
+        """
+        Returns `after_id` and `limit` for a paginated download, or `(None,
+        None)` if neither is given. `limit` is capped at
+        `EPICOLLECT_DOWNLOAD_MAX_LIMIT`. Raises `ValueError` for values that
+        are not valid.
+        """
+        after_id = request.GET.get('after_id')
+        limit = request.GET.get('limit')
+
+        if after_id is None and limit is None:
+            return None, None
+
+        after_id = int(after_id or 0)
+        limit = min(int(limit or DOWNLOAD_MAX_LIMIT), DOWNLOAD_MAX_LIMIT)
+
+        if after_id < 0 or limit < 1:
+            raise ValueError('after_id and limit must be positive.')
+
+        return after_id, limit
+
+    def get_snapshot_response(self, project, stats, serializer, format):
+        """
+        Returns a response that concatenates the stored rows of the project,
+        or `None` if its export snapshot does not match its observations.
+        """
+        with metrics.timer('download', 'snapshot'):
+            current = EpiCollectExportRow.objects.is_current(
+                project.id, stats['count'])
+
+        metrics.increment(
+            'epicollect_cache_total',
+            cache='export',
+            result='hit' if current else 'miss'
+        )
+        if not current:
+            return None
+
+        fragments = EpiCollectExportRow.objects.get_fragments(
+            project.id, format)
+
+        if format == 'tsv':
+            return StreamingHttpResponse(
+                metrics.count_bytes(
+                    serializer.stream_tsv_fragments(project, fragments),
+                    'download', format='tsv'
+                ),
+                content_type='text/plain; charset=utf-8'
+            )
 
+        return StreamingHttpResponse(
+            metrics.count_bytes(
+                serializer.stream_xml_fragments(project, fragments),
+                'download', format='xml'
+            ),
+            content_type='text/xml; charset=utf-8'
+        )
 
-class EpiCollectDownloadView(APIView):
     def get(self, request, project_id):
-        try:
-            epicollect = EpiCollectProjectModel.objects.get(pk=project_id)
+        with metrics.timer('download', 'lookup'):
+            project = get_enabled_project(project_id)
+        if project is None:
+            return HttpResponse(
+                '<error>The project must enabled for EpiCollect.</error>',
+                content_type='text/xml; charset=utf-8',
+                status=status.HTTP_403_FORBIDDEN
+            )
 
-            serializer = DataSerializer()
-            if request.GET.get('xml') == 'false':
-                tsv = serializer.serialize_to_tsv(epicollect.project)
-                return HttpResponse(
-                    tsv,
-                    content_type='text/plain; charset=utf-8'
-                )
-            else:
-                xml = serializer.serialize_to_xml(epicollect.project)
+        with metrics.timer('download', 'validators'):
+            stats = self.get_stats(project)
+            etag, last_modified = self.get_validators(request, project, stats)
+        # The ETag includes the number of observations, which changes when
+        # one is deleted in another process
+        response = self.get_not_modified_response(
+            request, etag, last_modified,
+            compare_last_modified=is_shared_cache()
+        )
+        if response is not None:
+            metrics.increment(
+                'epicollect_not_modified_total', view='download')
+            return response
+
+        since = request.GET.get('since')
+        if since is not None:
+            try:
+                since = parse_since(since)
+            except ValueError:
                 return HttpResponse(
-                    etree.tostring(xml),
-                    content_type='text/xml; charset=utf-8'
+                    '<error>Invalid value for since.</error>',
+                    content_type='text/xml; charset=utf-8',
+                    status=status.HTTP_400_BAD_REQUEST
                 )
-        except EpiCollectProjectModel.DoesNotExist:
+
+        try:
+            after_id, limit = self.get_page_parameters(request)
+        except ValueError:
             return HttpResponse(
-                '<error>The project must enabled for EpiCollect.</error>',
+                '<error>Invalid value for after_id or limit.</error>',
                 content_type='text/xml; charset=utf-8',
-                status=status.HTTP_403_FORBIDDEN
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        # Taken before the observations are queried and set back by
+        # `EPICOLLECT_CURSOR_OVERLAP` seconds: an entry can be committed
+        # after the query with a change time before it, e.g. by a batch
+        # upload. The next delta repeats entries changed in the overlap
+        # rather than missing them.
+        cursor = create_cursor(
+            timezone.now() - timedelta(seconds=CURSOR_OVERLAP))
+
+        serializer = DataSerializer()
+        format = 'tsv' if request.GET.get('xml') == 'false' else 'xml'
+
+        if since is None and limit is None:
+            response = self.get_snapshot_response(
+                project, stats, serializer, format)
+
+            if response is not None:
+                response['X-EpiCollect-Cursor'] = cursor
+                return self.set_validators(response, etag, last_modified)
+
+        observations = serializer.get_observations(project, since=since)
+
+        meta = []
+        if since is not None:
+            meta.append(('cursor', cursor))
+
+        next_after_id = None
+        if limit is not None:
+            observations, next_after_id = serializer.paginate(
+                observations, after_id, limit)
+            if next_after_id is not None:
+                meta.append(('next_after_id', next_after_id))
+
+        if format == 'tsv':
+            response = StreamingHttpResponse(
+                metrics.count_bytes(
+                    serializer.stream_tsv(project, observations, meta),
+                    'download', format='tsv'
+                ),
+                content_type='text/plain; charset=utf-8'
             )
+        else:
+            response = StreamingHttpResponse(
+                metrics.count_bytes(
+                    serializer.stream_xml(project, observations, meta),
+                    'download', format='xml'
+                ),
+                content_type='text/xml; charset=utf-8'
+            )
+
+        response['X-EpiCollect-Cursor'] = cursor
+        if next_after_id is not None:
+            response['X-EpiCollect-Next-After-Id'] = next_after_id
+        return self.set_validators(response, etag, last_modified)
+
+
+class EpiCollectMetricsView(View):
+    """
+    Responds with the metrics of this process in the Prometheus text format,
+    or `404 Not Found` if `EPICOLLECT_METRICS_ENABLED` is not set.
+    """
+    def get(self, request):
+        if not metrics.ENABLED:
+            raise Http404('Metrics are not enabled.')
+
+        gauges = []
+        for name, cache in [('project', project_cache), ('user', user_cache)]:
+            stats = cache.stats()
+            for key in ['hits', 'misses', 'items']:
+                gauges.append((
+                    'epicollect_lookup_cache_%s' % key,
+                    {'cache': name},
+                    stats[key]
+                ))
+
+        return HttpResponse(
+            metrics.registry.render(gauges),
+            content_type='text/plain; version=0.0.4; charset=utf-8'
+        )
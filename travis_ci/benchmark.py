@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+
+"""
+Runs the benchmarks of geokey_epicollect against a test database and writes
+the results as JSON. Pass `--baseline` with the results of an earlier run to
+print how each measurement changed.
+"""
+
+import os
+import sys
+import json
+import argparse
+
+
+def compare(results, baseline, path=()):
+    """Yields the measurements of both runs as (path, baseline, result)."""
+    for key, value in sorted(results.items()):
+        if key == 'size' or key not in baseline:
+            continue
+
+        if isinstance(value, dict):
+            for row in compare(value, baseline[key], path + (key,)):
+                yield row
+        elif isinstance(value, (int, float)):
+            yield '.'.join(path + (key,)), baseline[key], value
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '--sizes',
+        default='small,medium',
+        help='Comma-separated sizes to run: small, medium, large.'
+    )
+    parser.add_argument(
+        '--output',
+        default='benchmark.json',
+        help='File the results are written to.'
+    )
+    parser.add_argument(
+        '--baseline',
+        help='Results of an earlier run to compare with.'
+    )
+    args = parser.parse_args()
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'settings')
+
+    import django
+    django.setup()
+
+    from django.db import connection
+    from django.test.utils import (
+        setup_test_environment, teardown_test_environment
+    )
+    from geokey_epicollect.tests import benchmarks
+
+    setup_test_environment()
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0)
+
+    try:
+        results = benchmarks.run(args.sizes.split(','))
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+    with open(args.output, 'w') as output:
+        json.dump(results, output, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            baseline = json.load(baseline)['results']
+
+        for name, before, after in compare(results['results'], baseline):
+            change = float(after) / before if before else float('nan')
+            print('%-40s %14.6f %14.6f %7.2fx' % (name, before, after, change))
+
+
+if __name__ == '__main__':
+    main()